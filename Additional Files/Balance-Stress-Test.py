@@ -0,0 +1,61 @@
+# Hammer /add_balance and /income for a single user from many threads at once
+# and check that no balance update was lost.
+#
+# Usage: python "Additional Files/Balance-Stress-Test.py" [threads] [requests per thread]
+import os
+import sys
+import time
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from App import app, db, bcrypt, User, Balance
+
+THREADS = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+REQUESTS_PER_THREAD = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+USERNAME = 'stress'
+
+
+def worker(failures):
+    client = app.test_client()
+    client.post('/', data={'username': USERNAME, 'password': 'password'})
+    for i in range(REQUESTS_PER_THREAD):
+        # Alternate between the two routes that change the balance
+        if i % 2:
+            response = client.post('/add_balance', json={'amount': 1})
+        else:
+            response = client.post('/income', json={'amount': 1, 'source': 'Stress', 'date': '2024-01-01'})
+        if response.status_code not in (200, 201):
+            failures.append(response.status_code)
+
+
+if __name__ == '__main__':
+    database = os.path.join(tempfile.mkdtemp(), 'stress.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database}'
+    with app.app_context():
+        db.create_all()
+        user = User(username=USERNAME, email='stress@example.com',
+                    password_hash=bcrypt.generate_password_hash('password').decode('utf-8'))
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    failures = []
+    threads = [threading.Thread(target=worker, args=(failures,)) for _ in range(THREADS)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        balance = Balance.query.filter_by(user_id=user_id).first().amount
+
+    expected = THREADS * REQUESTS_PER_THREAD - len(failures)
+    print(f"{THREADS * REQUESTS_PER_THREAD} requests in {elapsed:.2f}s ({THREADS * REQUESTS_PER_THREAD / elapsed:.0f} req/s), {len(failures)} failed")
+    print(f"balance: {balance}, expected: {expected}")
+    if balance != expected:
+        print(f"LOST UPDATES: {expected - balance}")
+        sys.exit(1)
+    print('No lost updates')
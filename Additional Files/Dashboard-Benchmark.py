@@ -0,0 +1,102 @@
+# Compare dashboard render times with and without the fragment cache, and
+# template load times in a fresh worker with and without the bytecode cache.
+#
+# Usage: python "Additional Files/Dashboard-Benchmark.py" [--requests 50] [--years 3]
+#            [--expenses-per-month 40]
+import os
+import sys
+import time
+import runpy
+import argparse
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import event
+from App import app, db, fragment_cache
+
+generate_load_data = runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Load-Data.py'))['generate_load_data']
+
+TEMPLATES = ['Dashboard.html', 'DashboardSummary.html', 'DashboardTransactions.html', 'DashboardCharts.html']
+SEED = 42
+UNTIL = datetime(2025, 1, 1)
+
+statements = []
+
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+
+def time_requests(client, requests, before_each=None):
+    """Return the mean milliseconds and the most SQL statements of 'requests' dashboard renders."""
+    timings = []
+    counts = []
+    for i in range(requests):
+        if before_each:
+            before_each(i)
+        statements.clear()
+        started = time.perf_counter()
+        response = client.get('/dashboard')
+        timings.append((time.perf_counter() - started) * 1000)
+        counts.append(len(statements))
+        assert response.status_code == 200, response.status_code
+    return sum(timings) / len(timings), max(counts)
+
+
+def time_template_loads(bytecode_cache, rounds=20):
+    """Mean milliseconds to load the dashboard templates into a new environment, as a new worker would."""
+    total = 0.0
+    for _ in range(rounds):
+        env = app.create_jinja_environment()
+        env.bytecode_cache = bytecode_cache
+        env.filters.update(app.jinja_env.filters)
+        started = time.perf_counter()
+        for name in TEMPLATES:
+            env.get_template(name)
+        total += time.perf_counter() - started
+    return total / rounds * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark dashboard rendering and template loading.')
+    parser.add_argument('--requests', type=int, default=50, help='Timed requests per measurement.')
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--expenses-per-month', type=int, default=40)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(directory, 'benchmark.db')}"
+    with app.app_context():
+        db.create_all()
+        generate_load_data(1, args.years, args.expenses_per_month, SEED, UNTIL, prefix='dashboard')
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+
+    client = app.test_client()
+    client.post('/', data={'username': f'dashboard-{SEED}-0', 'password': 'password'})
+    client.get('/dashboard')
+
+    cache_size = fragment_cache.max_size
+    fragment_cache.max_size = 0
+    fragment_cache.entries.clear()
+    uncached_ms, uncached_statements = time_requests(client, args.requests)
+    fragment_cache.max_size = cache_size
+    client.get('/dashboard')
+    cached_ms, cached_statements = time_requests(client, args.requests)
+    # A new expense before every request, so every fragment is rendered again
+    changed_ms, changed_statements = time_requests(client, args.requests, lambda i: client.post(
+        '/expenses', json={'amount': '1.00', 'category': 'Groceries', 'date': '2024-12-01'}))
+
+    bytecode_cache = FileSystemBytecodeCache(tempfile.mkdtemp())
+    time_template_loads(bytecode_cache, rounds=1)
+    compile_ms = time_template_loads(None)
+    load_ms = time_template_loads(bytecode_cache)
+
+    print(f"dashboard, no fragment cache:    {uncached_ms:7.2f}ms  {uncached_statements} statement(s)")
+    print(f"dashboard, fragment cache hit:   {cached_ms:7.2f}ms  {cached_statements} statement(s)")
+    print(f"dashboard, after a data change:  {changed_ms:7.2f}ms  {changed_statements} statement(s)")
+    print(f"fragment cache speedup:          {uncached_ms / cached_ms:.1f}x")
+    print(f"templates, compiled from source: {compile_ms:7.2f}ms")
+    print(f"templates, from bytecode cache:  {load_ms:7.2f}ms")
+    print(f"bytecode cache speedup:          {compile_ms / load_ms:.1f}x")
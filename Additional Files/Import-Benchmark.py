@@ -0,0 +1,82 @@
+# Compare the throughput of the per-row /expenses and /income endpoints
+# against a single /import of the same rows as a CSV statement.
+#
+# Usage: python "Additional Files/Import-Benchmark.py" [number of rows]
+import os
+import sys
+import time
+import random
+import tempfile
+from io import BytesIO
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from App import app, db, bcrypt, User
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+CATEGORIES = ['Groceries', 'Dining', 'Shopping', 'Entertainment', 'Transportation']
+
+
+def make_rows(count):
+    random.seed(42)
+    start = datetime(2020, 1, 1)
+    rows = []
+    for i in range(count):
+        date = (start + timedelta(days=i % 1500)).strftime('%Y-%m-%d')
+        if i % 10 == 0:
+            rows.append(('income', round(random.uniform(500, 3000), 2), 'Salary', date))
+        else:
+            rows.append(('expense', round(random.uniform(1, 200), 2), random.choice(CATEGORIES), date))
+    return rows
+
+
+def fresh_client(username):
+    with app.app_context():
+        user = User(username=username, email=f'{username}@example.com',
+                    password_hash=bcrypt.generate_password_hash('password').decode('utf-8'))
+        db.session.add(user)
+        db.session.commit()
+    client = app.test_client()
+    client.post('/', data={'username': username, 'password': 'password'})
+    return client
+
+
+def per_row(rows):
+    client = fresh_client('per-row')
+    started = time.perf_counter()
+    for kind, amount, category, date in rows:
+        if kind == 'expense':
+            client.post('/expenses', json={'amount': amount, 'category': category, 'date': date})
+        else:
+            client.post('/income', json={'amount': amount, 'source': category, 'date': date})
+    return time.perf_counter() - started
+
+
+def bulk(rows):
+    client = fresh_client('bulk')
+    lines = ['date,amount,category']
+    lines += [f"{date},{amount if kind == 'income' else -amount},{category}" for kind, amount, category, date in rows]
+    statement = ('\n'.join(lines) + '\n').encode('utf-8')
+
+    started = time.perf_counter()
+    response = client.post('/import', data={'file': (BytesIO(statement), 'statement.csv')},
+                           content_type='multipart/form-data')
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 201, response.get_json()
+    return elapsed
+
+
+if __name__ == '__main__':
+    database = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database}'
+    with app.app_context():
+        db.create_all()
+
+    rows = make_rows(ROWS)
+    per_row_seconds = per_row(rows)
+    bulk_seconds = bulk(rows)
+
+    print(f"{ROWS} rows")
+    print(f"per-row endpoints: {per_row_seconds:.2f}s ({ROWS / per_row_seconds:.0f} rows/s)")
+    print(f"bulk /import:      {bulk_seconds:.2f}s ({ROWS / bulk_seconds:.0f} rows/s)")
+    print(f"speedup:           {per_row_seconds / bulk_seconds:.1f}x")
@@ -0,0 +1,117 @@
+# Fill the database configured by DATABASE_URL with synthetic users, expenses
+# and income for performance testing.
+#
+# Usage: python "Additional Files/Load-Data.py" [--users 10] [--years 3]
+#            [--expenses-per-month 40] [--seed 42] [--until YYYY-MM-DD] [--prefix load]
+#
+# Rows are written through the statement-import path, so summaries and balances
+# stay consistent. The same seed and --until date always give the same data.
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from App import app, db, User, CENT, IMPORT_BATCH_SIZE, flush_import_batch, hash_password
+
+# Synthetic spending, per category: (relative frequency, smallest amount, largest amount)
+LOAD_EXPENSE_CATEGORIES = {
+    'Groceries': (30, 15, 180),
+    'Dining': (25, 8, 90),
+    'Transportation': (20, 2, 60),
+    'Shopping': (12, 10, 300),
+    'Entertainment': (8, 5, 120),
+    'Utilities': (5, 40, 250),
+}
+
+
+def synthetic_ledger(rng, years, expenses_per_month, until):
+    """Yield (kind, amount, category, date) rows for one user, month by month, for the whole months before 'until'."""
+    categories = list(LOAD_EXPENSE_CATEGORIES)
+    weights = [LOAD_EXPENSE_CATEGORIES[category][0] for category in categories]
+    salary = rng.uniform(2500, 9000)
+    rent = salary * rng.uniform(0.25, 0.4)
+
+    def money(value):
+        return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+    year, month = until.year - years, until.month - 1
+    for _ in range(years * 12):
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+        start = datetime(year, month, 1)
+        days = ((start + timedelta(days=32)).replace(day=1) - start).days
+
+        yield 'income', money(salary * rng.uniform(0.98, 1.02)), 'Salary', start
+        if rng.random() < 0.1:
+            yield 'income', money(salary * rng.uniform(0.1, 0.5)), 'Bonus', start + timedelta(days=rng.randrange(days))
+        yield 'expense', money(rent), 'Rent', start
+
+        for category in rng.choices(categories, weights, k=max(expenses_per_month - 1, 0)):
+            low, high = LOAD_EXPENSE_CATEGORIES[category][1:]
+            yield 'expense', money(rng.uniform(low, high)), category, start + timedelta(days=rng.randrange(days), minutes=rng.randrange(24 * 60))
+
+
+def generate_load_data(users, years, expenses_per_month, seed, until, prefix='load'):
+    """Create users with synthetic histories through the bulk import path, returning (user ids, rows written).
+
+    Needs an application context. The same seed and 'until' date always produce the same amounts, categories and dates.
+    """
+    rng = random.Random(seed)
+    password_hash = hash_password('password')
+    user_ids = []
+    rows = 0
+    for n in range(users):
+        username = f'{prefix}-{seed}-{n}'
+        if User.query.filter_by(username=username).first() is not None:
+            raise ValueError(f"User {username!r} already exists; use another seed or prefix")
+        user = User(username=username, email=f'{username}@example.com', password_hash=password_hash)
+        db.session.add(user)
+        db.session.commit()
+        user_ids.append(user.id)
+
+        batch = []
+        for row in synthetic_ledger(rng, years, expenses_per_month, until):
+            batch.append(row)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush_import_batch(user.id, batch)
+                rows += len(batch)
+                batch = []
+        if batch:
+            flush_import_batch(user.id, batch)
+            rows += len(batch)
+    return user_ids, rows
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not at least 1")
+    return number
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fill the database with synthetic users, expenses and income.')
+    parser.add_argument('--users', type=positive_int, default=10)
+    parser.add_argument('--years', type=positive_int, default=3)
+    parser.add_argument('--expenses-per-month', type=positive_int, default=40)
+    parser.add_argument('--seed', type=int, default=42, help='Same seed, same data.')
+    parser.add_argument('--until', type=lambda value: datetime.strptime(value, '%Y-%m-%d'),
+                        help='History ends the month before this day, defaults to today.')
+    parser.add_argument('--prefix', default='load', help='Usernames are <prefix>-<seed>-<n>.')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    with app.app_context():
+        try:
+            user_ids, rows = generate_load_data(args.users, args.years, args.expenses_per_month, args.seed,
+                                                args.until or datetime.utcnow(), args.prefix)
+        except ValueError as e:
+            sys.exit(str(e))
+    elapsed = time.perf_counter() - started
+    print(f"Created {len(user_ids)} user(s) with {rows} ledger row(s) in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s)")
+    print(f"Log in as {args.prefix}-{args.seed}-0 with password 'password'")
@@ -0,0 +1,87 @@
+# Count the SQL statements each read route issues for a logged-in user,
+# and fail if any route goes over its budget.
+#
+# Usage: python "Additional Files/Query-Count.py"
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from sqlalchemy import event
+from App import app, db, bcrypt, User
+
+# Maximum statements per request, once the user is in the identity cache
+ROUTE_BUDGETS = {
+    # Includes the category totals for the charts, which used to be a second request
+    '/dashboard': 5,
+    '/add_balance': 1,
+    '/income': 1,
+    '/expenses': 1,
+    '/get_transactions': 2,
+    '/get_category_totals': 2,
+    '/search?q=groc&min_amount=1': 3,
+}
+
+# Maximum statements to answer a repeat request with 304 Not Modified
+REVALIDATION_BUDGETS = {
+    '/get_transactions': 1,
+    '/get_category_totals': 1,
+}
+
+# Maximum statements for a repeat request whose page fragments are all cached
+FRAGMENT_CACHE_BUDGETS = {
+    '/dashboard': 1,
+}
+
+statements = []
+
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+
+if __name__ == '__main__':
+    database = os.path.join(tempfile.mkdtemp(), 'query-count.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database}'
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username='counter', email='counter@example.com',
+                            password_hash=bcrypt.generate_password_hash('password').decode('utf-8')))
+        db.session.commit()
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+
+    client = app.test_client()
+    client.post('/', data={'username': 'counter', 'password': 'password'})
+    client.post('/expenses', json={'amount': 10, 'category': 'Groceries', 'date': '2024-01-01'})
+    client.post('/income', json={'amount': 100, 'source': 'Salary', 'date': '2024-01-01'})
+
+    over_budget = []
+    for route, budget in ROUTE_BUDGETS.items():
+        statements.clear()
+        response = client.get(route)
+        print(f"{route}: {len(statements)} statement(s), budget {budget}, status {response.status_code}")
+        if len(statements) > budget:
+            over_budget.append(route)
+            for statement in statements:
+                print('   ', ' '.join(statement.split())[:120])
+
+    for route, budget in REVALIDATION_BUDGETS.items():
+        etag = client.get(route).headers.get('ETag')
+        statements.clear()
+        response = client.get(route, headers={'If-None-Match': etag})
+        print(f"{route} (revalidation): {len(statements)} statement(s), budget {budget}, status {response.status_code}")
+        if len(statements) > budget or response.status_code != 304:
+            over_budget.append(f"{route} (revalidation)")
+
+    for route, budget in FRAGMENT_CACHE_BUDGETS.items():
+        client.get(route)
+        statements.clear()
+        response = client.get(route)
+        print(f"{route} (cached fragments): {len(statements)} statement(s), budget {budget}, status {response.status_code}")
+        if len(statements) > budget:
+            over_budget.append(f"{route} (cached fragments)")
+
+    if over_budget:
+        print(f"Over budget: {', '.join(over_budget)}")
+        sys.exit(1)
+    print('All routes within budget')
@@ -0,0 +1,124 @@
+# Run the per-user routes against a scratch SQLite database, EXPLAIN every
+# query they issue, and fail if any of them reads a whole table.
+#
+# The plans come from the SQL the routes actually send, so a change to a
+# route or one of its helpers is checked without updating this script.
+#
+# Usage: python "Additional Files/Query-Plans.py"
+import os
+import re
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from sqlalchemy import event
+from App import app, db, bcrypt, User, ReportJob, fragment_cache, run_report_job
+
+# (method, path, JSON body) for every per-user read, with the variants that change the query
+REQUESTS = [
+    ('GET', '/dashboard', None),
+    ('GET', '/dashboard?format=json&cursor=2024-06-01T00:00:00,1000', None),
+    ('GET', '/get_transactions', None),
+    ('GET', '/get_category_totals', None),
+    ('GET', '/get_category_totals?bucket=month&start=2024-01-01&end=2024-06-30', None),
+    ('GET', '/expenses?format=json', None),
+    ('GET', '/expenses?format=json&cursor=2024-06-01T00:00:00,1000', None),
+    ('GET', '/income?format=json&cursor=2024-06-01T00:00:00,1000', None),
+    ('GET', '/export/expenses', None),
+    ('GET', '/export/income', None),
+    ('GET', '/transactions/Groceries?start=2024-01-01&end=2024-06-30', None),
+    ('GET', '/search?q=groc&min_amount=5', None),
+    ('GET', '/search?q=sal&type=income', None),
+    ('GET', '/search?max_amount=50&start=2024-01-01', None),
+    ('GET', '/budgets?date=2024-03-15', None),
+    ('GET', '/goals', None),
+    ('POST', '/reports', {'month': '2024-03', 'format': 'csv'}),
+    ('GET', '/reports', None),
+]
+
+statements = []
+
+
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    if not executemany:
+        statements.append((statement, parameters))
+
+
+def is_table_scan(detail):
+    """Check if an EXPLAIN QUERY PLAN step reads a whole table.
+
+    Scans of a subquery's already-limited rows (anon_N) and full-text MATCH
+    lookups, which SQLite reports as a virtual table scan with an index, are not.
+    """
+    if not detail.startswith('SCAN'):
+        return False
+    if re.match(r'SCAN anon_\d+$', detail):
+        return False
+    return not re.search(r'VIRTUAL TABLE INDEX \d+:M', detail)
+
+
+def check(label, captured, connection):
+    """Print the plan of each captured read and return True if any of them scans a table."""
+    scans = False
+    for statement, parameters in captured:
+        if not statement.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE')):
+            continue
+        plan = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+        details = [row[-1] for row in plan]
+        scan = any(is_table_scan(detail) for detail in details)
+        scans = scans or scan
+        print(f"{'SCAN ' if scan else ''}{label}: {' '.join(statement.split())[:100]}")
+        print(f"    {'; '.join(details)}")
+    return scans
+
+
+if __name__ == '__main__':
+    database = os.path.join(tempfile.mkdtemp(), 'query-plans.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database}'
+    app.config['REPORT_DIR'] = tempfile.mkdtemp()
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username='planner', email='planner@example.com',
+                            password_hash=bcrypt.generate_password_hash('password').decode('utf-8')))
+        db.session.commit()
+
+    client = app.test_client()
+    client.post('/', data={'username': 'planner', 'password': 'password'})
+    for month in range(1, 7):
+        client.post('/expenses', json={'amount': '42.50', 'category': 'Groceries', 'date': f'2024-{month:02d}-10'})
+        client.post('/income', json={'amount': '3000', 'source': 'Salary', 'date': f'2024-{month:02d}-01'})
+    client.post('/budgets', json={'category': 'Groceries', 'limit': '400'})
+    client.post('/goals', json={'target_amount': '10000'})
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record_statement)
+
+    failures = []
+    for method, path, body in REQUESTS:
+        fragment_cache.entries.clear()
+        statements.clear()
+        # Read the body so streamed exports run their queries before the plans are checked
+        response = client.open(path, method=method, json=body)
+        response.get_data()
+        response.close()
+        assert response.status_code < 400, f"{method} {path}: {response.status_code}"
+        captured = list(statements)
+        with app.app_context(), db.engine.connect() as connection:
+            if check(f"{method} {path}", captured, connection):
+                failures.append(f"{method} {path}")
+
+    # Statements are generated by the report worker, outside any request
+    with app.app_context():
+        job = ReportJob.query.filter_by(status='pending').first()
+        statements.clear()
+        run_report_job(job)
+        captured = list(statements)
+        with db.engine.connect() as connection:
+            if check('report worker', captured, connection):
+                failures.append('report worker')
+        event.remove(db.engine, 'before_cursor_execute', record_statement)
+
+    if failures:
+        print(f"Full table scan in: {', '.join(failures)}")
+        sys.exit(1)
+    print('Every query uses an index')
@@ -0,0 +1,160 @@
+# Measure latency percentiles and SQL statement counts of the main routes
+# against generated databases of increasing size, and write them to JSON.
+#
+# Usage: python "Additional Files/Route-Benchmark.py" [--sizes 1000,100000,1000000]
+#            [--requests 20] [--output benchmark-results.json] [--baseline previous.json]
+#
+# With --baseline, routes whose statement count grew, or whose p95 latency grew
+# by more than --tolerance times, are reported and the script exits with status 1.
+import os
+import sys
+import json
+import time
+import runpy
+import argparse
+import platform
+import sqlite3
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from sqlalchemy import event
+from App import app, db, fragment_cache, LedgerEntry
+
+generate_load_data = runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Load-Data.py'))['generate_load_data']
+
+USERS = 10
+YEARS = 5
+SEED = 42
+UNTIL = datetime(2025, 1, 1)
+
+# name: (method, path, JSON body factory or None)
+ROUTES = {
+    'dashboard': ('GET', '/dashboard', None),
+    'dashboard_cached': ('GET', '/dashboard', None),
+    'get_transactions': ('GET', '/get_transactions', None),
+    'get_expenses': ('GET', '/expenses', None),
+    'get_income': ('GET', '/income', None),
+    'search': ('GET', '/search?q=groc&min_amount=20', None),
+    'add_expense': ('POST', '/expenses', lambda i: {'amount': '12.34', 'category': 'Groceries', 'date': f'2024-12-{i % 28 + 1:02d}'}),
+    'add_income': ('POST', '/income', lambda i: {'amount': '100.00', 'source': 'Freelance', 'date': f'2024-12-{i % 28 + 1:02d}'}),
+}
+
+# Routes timed with an empty fragment cache, so they measure rendering rather than a cache hit
+UNCACHED_ROUTES = {'dashboard'}
+
+statements = []
+
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+
+
+def expenses_per_month(rows):
+    """Expenses per user per month that give roughly 'rows' ledger rows in total (one salary a month each)."""
+    return max(1, round(rows / (USERS * YEARS * 12)) - 1)
+
+
+def benchmark_size(rows, requests):
+    database = os.path.join(tempfile.mkdtemp(), f'benchmark-{rows}.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database}'
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        user_ids, written = generate_load_data(USERS, YEARS, expenses_per_month(rows), SEED, UNTIL, prefix='bench')
+        generate_seconds = time.perf_counter() - started
+        user_rows = LedgerEntry.query.filter_by(user_id=user_ids[0]).count()
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+
+    client = app.test_client()
+    client.post('/', data={'username': f'bench-{SEED}-0', 'password': 'password'})
+
+    results = {}
+    for name, (method, path, body) in ROUTES.items():
+        # One untimed request warms the user cache and compiled statement cache
+        client.open(path, method=method, json=body(0) if body else None)
+        timings = []
+        counts = []
+        for i in range(requests):
+            if name in UNCACHED_ROUTES:
+                fragment_cache.entries.clear()
+            statements.clear()
+            started = time.perf_counter()
+            response = client.open(path, method=method, json=body(i + 1) if body else None)
+            timings.append((time.perf_counter() - started) * 1000)
+            counts.append(len(statements))
+            assert response.status_code < 400, f"{name}: {response.status_code}"
+        results[name] = {
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'mean_ms': round(sum(timings) / len(timings), 2),
+            'statements': max(counts),
+        }
+        print(f"  {name:<17} p50 {results[name]['p50_ms']:>8.2f}ms  p95 {results[name]['p95_ms']:>8.2f}ms  "
+              f"p99 {results[name]['p99_ms']:>8.2f}ms  {results[name]['statements']} statement(s)")
+
+    with app.app_context():
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+    return {'rows': written, 'user_rows': user_rows, 'generate_seconds': round(generate_seconds, 2), 'routes': results}
+
+
+def compare(results, baseline, tolerance):
+    """Print each route against the baseline and return the regressions found."""
+    regressions = []
+    for size, current in results['sizes'].items():
+        previous = baseline.get('sizes', {}).get(size)
+        if previous is None:
+            continue
+        for name, route in current['routes'].items():
+            before = previous['routes'].get(name)
+            if before is None:
+                continue
+            ratio = route['p95_ms'] / before['p95_ms'] if before['p95_ms'] else 1.0
+            print(f"{size} {name}: p95 {before['p95_ms']}ms -> {route['p95_ms']}ms ({ratio:.2f}x), "
+                  f"statements {before['statements']} -> {route['statements']}")
+            if route['statements'] > before['statements']:
+                regressions.append(f"{size} {name}: statements {before['statements']} -> {route['statements']}")
+            if ratio > tolerance:
+                regressions.append(f"{size} {name}: p95 {ratio:.2f}x slower")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the main routes at several database sizes.')
+    parser.add_argument('--sizes', default='1000,100000,1000000', help='Comma-separated ledger row counts.')
+    parser.add_argument('--requests', type=int, default=20, help='Timed requests per route and size.')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help='Earlier results file to compare against.')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='Allowed p95 slowdown against the baseline.')
+    args = parser.parse_args()
+
+    results = {
+        'created': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'requests_per_route': args.requests,
+        'sizes': {},
+    }
+    for size in [int(size) for size in args.sizes.split(',')]:
+        print(f"{size} rows:")
+        results['sizes'][str(size)] = benchmark_size(size, args.requests)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('Regressions:')
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print('No regressions')
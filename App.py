@@ -1,16 +1,151 @@
-from flask import Flask, jsonify, request, render_template, redirect, url_for, session
+from flask import Flask, jsonify, request, render_template, redirect, url_for, session, Response, stream_with_context, g, has_request_context, send_file
 from flask_sqlalchemy import SQLAlchemy
+from flask.json import JSONEncoder
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_bcrypt import Bcrypt
+import flask_bcrypt
+from flask_migrate import Migrate
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
 from werkzeug.security import generate_password_hash
-from datetime import datetime
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy import func, tuple_, event, and_, or_, cast, Integer
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+from sqlalchemy.types import TypeDecorator
+from dotenv import load_dotenv
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import wraps
 import os
+import re
+import csv
+import gzip
+import json
+import hashlib
+import html
+import click
+import sqlite3
+import time
+import cProfile
 import logging
+import threading
+import tempfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from weasyprint import HTML as PdfDocument
+except ImportError:
+    PdfDocument = None
+
+# Settings come from the environment, optionally via a .env file (see .env.example)
+load_dotenv()
+
+def database_url():
+    """Return DATABASE_URL, accepting the postgres:// scheme some hosts still hand out."""
+    url = os.environ.get('DATABASE_URL', 'sqlite:///finance.db')
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+def secret_key():
+    """Return SECRET_KEY, or a random per-process key when it is unset."""
+    key = os.environ.get('SECRET_KEY')
+    if key == 'change-me':
+        # The placeholder is public, so anyone could sign a session cookie for any user
+        raise RuntimeError("SECRET_KEY is still the 'change-me' placeholder; generate one with "
+                           "python -c \"import secrets; print(secrets.token_hex())\"")
+    return key or os.urandom(24)
+
+def engine_options(url):
+    """Build the SQLAlchemy engine options for the configured database."""
+    if url.startswith('sqlite'):
+        # SQLite has no server-side pool to size; its pragmas are set per connection below
+        return {}
+    options = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+    }
+    statement_timeout = os.environ.get('DB_STATEMENT_TIMEOUT_MS')
+    if statement_timeout and url.startswith('postgresql'):
+        options['connect_args'] = {'options': f'-c statement_timeout={int(statement_timeout)}'}
+    return options
+
+def json_default(value):
+    """Serialise money as a JSON number; Decimal amounts always have at most two decimal places."""
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class MoneyJSONEncoder(JSONEncoder):
+    def default(self, o):
+        if isinstance(o, Decimal):
+            return json_default(o)
+        return super().default(o)
+
+class LazyBytecodeCache(FileSystemBytecodeCache):
+    """A template bytecode cache whose directory is only created once a template is compiled."""
+
+    def dump_bytecode(self, bucket):
+        os.makedirs(self.directory, exist_ok=True)
+        super().dump_bytecode(bucket)
 
 app = Flask(__name__, static_url_path='/static', static_folder='templates')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///finance.db'
-app.config['SECRET_KEY'] = os.urandom(24)
+app.json_encoder = MoneyJSONEncoder
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Every gunicorn worker must share the same key, or sessions only work on the worker that issued them
+app.config['SECRET_KEY'] = secret_key()
+app.config['SQLITE_WAL'] = os.environ.get('SQLITE_WAL', '').lower() in ('1', 'true', 'yes')
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 1024))
+app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 60))
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+# Processes that bcrypt work is sent to, per worker; 0 hashes inside the request instead
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['LOGIN_RATE_LIMIT'] = int(os.environ.get('LOGIN_RATE_LIMIT', 10))
+app.config['LOGIN_RATE_WINDOW'] = float(os.environ.get('LOGIN_RATE_WINDOW', 60))
+app.config['SIGNUP_RATE_LIMIT'] = int(os.environ.get('SIGNUP_RATE_LIMIT', 10))
+app.config['SIGNUP_RATE_WINDOW'] = float(os.environ.get('SIGNUP_RATE_WINDOW', 600))
+# Reverse proxies in front of the app whose X-Forwarded-For/-Proto headers are trusted; 0 trusts none
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+# Statements slower than this are logged with their SQL
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 200))
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+# Profile every request, or only those sent with an 'X-Profile: 1' header when PROFILE_ALLOW_HEADER is on
+app.config['PROFILE_REQUESTS'] = os.environ.get('PROFILE_REQUESTS', '').lower() in ('1', 'true', 'yes')
+app.config['PROFILE_ALLOW_HEADER'] = os.environ.get('PROFILE_ALLOW_HEADER', '').lower() in ('1', 'true', 'yes')
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+app.config['REPORT_DIR'] = os.path.abspath(os.environ.get('REPORT_DIR', 'reports'))
+app.config['REPORT_POLL_INTERVAL'] = float(os.environ.get('REPORT_POLL_INTERVAL', 2))
+app.config['REPORT_JOB_TIMEOUT'] = float(os.environ.get('REPORT_JOB_TIMEOUT', 600))
+# Compiled templates are kept here, so a new worker loads them instead of compiling every template again
+app.config['JINJA_CACHE_DIR'] = os.environ.get('JINJA_CACHE_DIR', 'jinja-cache')
+app.config['FRAGMENT_CACHE_SIZE'] = int(os.environ.get('FRAGMENT_CACHE_SIZE', 4096))
+if app.config['JINJA_CACHE_DIR']:
+    # Relative to the app, not the current directory, so CLI commands and scripts share the workers' cache
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': LazyBytecodeCache(os.path.join(app.root_path, app.config['JINJA_CACHE_DIR']))}
+if app.config['TRUSTED_PROXIES']:
+    # Behind a proxy remote_addr is the proxy's, so rate limits would be shared by every client
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'], x_proto=app.config['TRUSTED_PROXIES'])
 db = SQLAlchemy(app)
+
+def include_in_migrations(name, type_, parent_names):
+    """Keep autogenerate away from the FTS5 search tables, which the models don't describe."""
+    return not (type_ == 'table' and name.startswith('category_search'))
+
+migrate = Migrate(app, db, include_name=include_in_migrations)
 bcrypt = Bcrypt(app)
 logging.basicConfig(level=logging.INFO)
 
@@ -18,6 +153,189 @@ login_manager = LoginManager()
 login_manager.login_view = 'login'
 login_manager.init_app(app)
 
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Let SQLite writers from several workers queue up instead of failing, when SQLITE_WAL is on."""
+    if not isinstance(dbapi_connection, sqlite3.Connection) or not app.config['SQLITE_WAL']:
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT_MS'])}")
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metrics:
+    """Per-process request and SQL counters, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.requests = {}
+        self.sql_statements = {}
+        self.sql_seconds = {}
+        self.slow_queries = {}
+
+    def record_request(self, endpoint, method, status, seconds, sql_statements, sql_seconds, slow_queries):
+        with self.lock:
+            buckets, total, count = self.latency.get(endpoint, ([0] * len(LATENCY_BUCKETS), 0.0, 0))
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+            self.latency[endpoint] = (buckets, total + seconds, count + 1)
+
+            key = (endpoint, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.sql_statements[endpoint] = self.sql_statements.get(endpoint, 0) + sql_statements
+            self.sql_seconds[endpoint] = self.sql_seconds.get(endpoint, 0.0) + sql_seconds
+            self.slow_queries[endpoint] = self.slow_queries.get(endpoint, 0) + slow_queries
+
+    def render(self):
+        lines = []
+        with self.lock:
+            lines.append('# HELP fms_request_duration_seconds Request latency by endpoint.')
+            lines.append('# TYPE fms_request_duration_seconds histogram')
+            for endpoint, (buckets, total, count) in sorted(self.latency.items()):
+                for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                    lines.append(f'fms_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {bucket_count}')
+                lines.append(f'fms_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {count}')
+                lines.append(f'fms_request_duration_seconds_sum{{endpoint="{endpoint}"}} {total}')
+                lines.append(f'fms_request_duration_seconds_count{{endpoint="{endpoint}"}} {count}')
+
+            lines.append('# HELP fms_requests_total Requests by endpoint, method and status.')
+            lines.append('# TYPE fms_requests_total counter')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'fms_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+
+            for name, help_text, values in (
+                ('fms_sql_statements_total', 'SQL statements executed, by endpoint.', self.sql_statements),
+                ('fms_sql_duration_seconds_total', 'Time spent executing SQL, by endpoint.', self.sql_seconds),
+                ('fms_slow_queries_total', 'SQL statements slower than SLOW_QUERY_MS, by endpoint.', self.slow_queries),
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for endpoint, value in sorted(values.items()):
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    """Add the statement's time to the current request's totals, logging it if it was slow."""
+    seconds = time.perf_counter() - conn.info['statement_started'].pop()
+    slow = seconds * 1000 >= app.config['SLOW_QUERY_MS']
+    if slow:
+        app.logger.warning(f"Slow query ({seconds * 1000:.0f} ms): {' '.join(statement.split())}")
+    if has_request_context() and 'sql_statements' in g:
+        g.sql_statements += 1
+        g.sql_seconds += seconds
+        g.slow_queries += int(slow)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0.0
+    g.slow_queries = 0
+    if app.config['PROFILE_REQUESTS'] or (app.config['PROFILE_ALLOW_HEADER'] and request.headers.get('X-Profile') == '1'):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_started' not in g:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    seconds = time.perf_counter() - g.request_started
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+        path = os.path.join(app.config['PROFILE_DIR'], f"{endpoint}-{datetime.utcnow():%Y%m%dT%H%M%S%f}.prof")
+        profiler.dump_stats(path)
+        app.logger.info(f"Wrote request profile to {path}")
+
+    metrics.record_request(endpoint, request.method, response.status_code, seconds,
+                           g.sql_statements, g.sql_seconds, g.slow_queries)
+    return response
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+@app.after_request
+def compress_response(response):
+    """Compress large JSON responses with brotli (if installed) or gzip, whichever the client accepts."""
+    if (response.status_code != 200 or response.mimetype != 'application/json'
+            or response.is_streamed or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.content_length is None or response.content_length < app.config['COMPRESS_MIN_SIZE']:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        encoding, data = 'br', brotli.compress(response.get_data(), quality=BROTLI_QUALITY)
+    elif accepted['gzip']:
+        encoding, data = 'gzip', gzip.compress(response.get_data(), compresslevel=GZIP_LEVEL)
+    else:
+        return response
+
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    # Each encoding is a different representation, so it needs its own strong ETag
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+# Prometheus scrape endpoint; each gunicorn worker reports its own counters
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+CENT = Decimal('0.01')
+
+class Money(TypeDecorator):
+    """A monetary amount, stored as an integer number of cents and read back as a Decimal.
+
+    Integer storage keeps SUM() exact and cheap in the database, however many
+    rows are added up, which floats could not.
+    """
+    impl = db.BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return int((Decimal(str(value)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return (Decimal(int(value)) / 100).quantize(CENT)
+
+def parse_amount(value):
+    """Parse a user-supplied amount into a Decimal rounded to cents, raising ValueError if it isn't a number."""
+    try:
+        amount = Decimal(str(value).strip().replace(',', ''))
+    except InvalidOperation:
+        raise ValueError(f"invalid amount {value!r}")
+    if not amount.is_finite():
+        raise ValueError(f"invalid amount {value!r}")
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
+
+@app.template_filter('money')
+def format_money(value):
+    return f"{value or 0:,.2f}"
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -25,32 +343,103 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(128))
     balance = db.relationship('Balance', backref='user', uselist=False)
 
-class Transaction(db.Model):
+# Every expense and income record is one row of the ledger; 'kind' says which.
+# Expense and Income below are views of it, so queries on them only see their own kind.
+class LedgerEntry(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
-    category = db.Column(db.String(50), nullable=False)
-    date = db.Column(db.DateTime, nullable=False)
+    kind = db.Column(db.String(10), nullable=False)
+    amount = db.Column('amount_cents', Money, nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
+    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Joined into the same SELECT, so reading .category never costs another query
+    category_ref = db.relationship('Category', lazy='joined')
+
+    __table_args__ = (
+        db.Index('ix_ledger_entry_user_id_kind_date', 'user_id', 'kind', 'date'),
+        db.Index('ix_ledger_entry_user_id_kind_category_id_date', 'user_id', 'kind', 'category_id', 'date'),
+        # Newest-first listings across both kinds, as /search returns them
+        db.Index('ix_ledger_entry_user_id_date', 'user_id', 'date'),
+    )
+    __mapper_args__ = {'polymorphic_on': kind}
+
+    @property
+    def category(self):
+        return self.category_ref.name if self.category_ref else None
+
+# Each user's expense categories and income sources, stored once and referenced by id from the ledger
+class Category(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'name', name='uq_category_user_id_name'),
+    )
+
+# SQLite full-text index of category names. Triggers keep it in step with the category table, however
+# rows are written; the owner column holds 'u<user_id>' so a search only matches the user's own names.
+CATEGORY_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE category_search USING fts5(name, owner, tokenize='porter unicode61 remove_diacritics 2')",
+    """CREATE TRIGGER category_search_insert AFTER INSERT ON category BEGIN
+        INSERT INTO category_search (rowid, name, owner) VALUES (new.id, new.name, 'u' || new.user_id);
+    END""",
+    """CREATE TRIGGER category_search_update AFTER UPDATE ON category BEGIN
+        UPDATE category_search SET name = new.name, owner = 'u' || new.user_id WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER category_search_delete AFTER DELETE ON category BEGIN
+        DELETE FROM category_search WHERE rowid = old.id;
+    END""",
+)
+
+@event.listens_for(Category.__table__, 'after_create')
+def create_category_search(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        for statement in CATEGORY_SEARCH_DDL:
+            connection.exec_driver_sql(statement)
+
+@event.listens_for(Category.__table__, 'before_drop')
+def drop_category_search(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql('DROP TABLE IF EXISTS category_search')
 
 class SavingsGoal(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    target_amount = db.Column(db.Float, nullable=False)
-    current_amount = db.Column(db.Float, default=0.0)
+    target_amount = db.Column('target_amount_cents', Money, nullable=False)
+    current_amount = db.Column('current_amount_cents', Money, default=0)
     deadline = db.Column(db.DateTime)
 
+    __table_args__ = (
+        db.Index('ix_savings_goal_user_id', 'user_id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'target_amount': self.target_amount,
+            'current_amount': self.current_amount,
+            'deadline': self.deadline.isoformat() if self.deadline else None
+        }
+
 class Budget(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     category = db.Column(db.String(50), nullable=False)
-    limit = db.Column(db.Float, nullable=False)
+    limit = db.Column('limit_cents', Money, nullable=False)
 
-class Income(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
-    source = db.Column(db.String(100))
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_budget_user_id_category', 'user_id', 'category'),
+    )
+
+class Income(LedgerEntry):
+    __mapper_args__ = {'polymorphic_identity': 'income'}
+
+    # An income's source is kept as its category
+    @property
+    def source(self):
+        return self.category
 
     def to_dict(self):
         return {
@@ -61,12 +450,8 @@ class Income(db.Model):
             'date': self.date.isoformat()
         }
 
-class Expense(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
-    category = db.Column(db.String(100))
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+class Expense(LedgerEntry):
+    __mapper_args__ = {'polymorphic_identity': 'expense'}
 
     def to_dict(self):
         return {
@@ -76,12 +461,76 @@ class Expense(db.Model):
             'category': self.category,
             'date': self.date.isoformat()
         }
-    
+
+# Transactions used to be a second copy of every expense; they are now the expenses themselves
+Transaction = Expense
+
 class Balance(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    amount = db.Column(db.Float, nullable=False, default=0.0)
+    amount = db.Column('amount_cents', Money, nullable=False, default=0)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
 
+# Running totals per user, kept in step with the raw rows by add_expense/add_income
+class UserSummary(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    total_spent = db.Column('total_spent_cents', Money, nullable=False, default=0)
+    expense_count = db.Column(db.Integer, nullable=False, default=0)
+    total_income = db.Column('total_income_cents', Money, nullable=False, default=0)
+    income_count = db.Column(db.Integer, nullable=False, default=0)
+
+# Running totals per user, month and category ('expense') or source ('income')
+class MonthlySummary(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    kind = db.Column(db.String(10), primary_key=True)
+    month = db.Column(db.String(7), primary_key=True)
+    category = db.Column(db.String(100), primary_key=True)
+    total = db.Column('total_cents', Money, nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+# Advanced in the same transaction as every change to a user's expenses, income or balance,
+# so cached responses can be revalidated from this one row
+class DataVersion(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# Statement requests; the table is also the queue that `flask report-worker` polls
+class ReportJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    month = db.Column(db.String(7), nullable=False)
+    fmt = db.Column(db.String(4), nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    # The user's data version the finished file was generated from
+    data_version = db.Column(db.Integer, nullable=False, default=0)
+    path = db.Column(db.String(255))
+    error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_report_job_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_report_job_user_id_month_fmt', 'user_id', 'month', 'fmt'),
+        db.Index('ix_report_job_status_id', 'status', 'id'),
+        # At most one queued or running job per statement, so identical requests share it
+        db.Index('uq_report_job_active', 'user_id', 'month', 'fmt', unique=True,
+                 sqlite_where=db.text("status IN ('pending', 'running')"),
+                 postgresql_where=db.text("status IN ('pending', 'running')")),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'month': self.month,
+            'format': self.fmt,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'download_url': url_for('download_report', job_id=self.id) if self.status == 'done' else None,
+        }
+
 @app.errorhandler(404)
 def page_not_found(e):
     # note that we set the 404 status explicitly
@@ -91,14 +540,374 @@ def page_not_found(e):
 def internal_server_error(e):
     return render_template('error.html', error='Internal server error'), 500
     
+class UserCache:
+    """Per-process LRU cache of logged-in users' identity, with a time-to-live.
+
+    Only the User row is cached, as a detached copy, so nothing request-specific
+    leaks between requests. The TTL bounds how long another worker's profile
+    change can go unnoticed; changes made in this process call invalidate().
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return user
+
+    def put(self, user):
+        copy = User(id=user.id, username=user.username, email=user.email, password_hash=user.password_hash)
+        make_transient_to_detached(copy)
+        with self.lock:
+            self.entries[user.id] = (time.monotonic() + self.ttl, copy)
+            self.entries.move_to_end(user.id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+user_cache = UserCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+class FragmentCache:
+    """Per-process LRU cache of rendered page fragments, per user and fragment name.
+
+    Each entry remembers the data version it was rendered from and is only
+    served while the user's data version is unchanged, so a write in any
+    worker makes every worker re-render it. A size of 0 disables the cache.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id, name, version):
+        with self.lock:
+            entry = self.entries.get((user_id, name))
+            if entry is None or entry[0] != version:
+                return None
+            self.entries.move_to_end((user_id, name))
+            return entry[1]
+
+    def put(self, user_id, name, version, html):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[(user_id, name)] = (version, html)
+            self.entries.move_to_end((user_id, name))
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+fragment_cache = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'])
+
+class RateLimiter:
+    """Per-process sliding-window limit on how often a key (an IP or a username) may be used."""
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.hits = {}
+        self.lock = threading.Lock()
+
+    def _recent(self, key, now):
+        """Return the key's attempts still inside the window; call with the lock held."""
+        hits = self.hits.setdefault(key, deque())
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+        return hits
+
+    def _record(self, hits, now):
+        hits.append(now)
+        if len(self.hits) > 10000:
+            self.hits = {k: v for k, v in self.hits.items() if v and v[-1] > now - self.window}
+
+    def allow(self, key):
+        """Record an attempt for the key and return False if it is over the limit."""
+        now = time.monotonic()
+        with self.lock:
+            hits = self._recent(key, now)
+            if len(hits) >= self.limit:
+                return False
+            self._record(hits, now)
+            return True
+
+    def exceeded(self, key):
+        """Check if the key is over the limit, without recording an attempt."""
+        with self.lock:
+            return len(self._recent(key, time.monotonic())) >= self.limit
+
+    def record(self, key):
+        """Record an attempt for the key, e.g. only once it has failed."""
+        now = time.monotonic()
+        with self.lock:
+            self._record(self._recent(key, now), now)
+
+login_limiter = RateLimiter(app.config['LOGIN_RATE_LIMIT'], app.config['LOGIN_RATE_WINDOW'])
+signup_limiter = RateLimiter(app.config['SIGNUP_RATE_LIMIT'], app.config['SIGNUP_RATE_WINDOW'])
+
+# bcrypt is deliberately slow, so hashing runs in a small process pool on other
+# cores instead of holding the request worker's CPU for the whole computation
+password_pool = None
+password_pool_lock = threading.Lock()
+
+def _hash_password(password, rounds):
+    return flask_bcrypt.generate_password_hash(password, rounds).decode('utf-8')
+
+def _check_password(password_hash, password):
+    return flask_bcrypt.check_password_hash(password_hash, password)
+
+def run_password_job(function, *args):
+    """Run a bcrypt function in the password pool, or inline if the pool is disabled."""
+    global password_pool
+    if app.config['PASSWORD_HASH_WORKERS'] <= 0:
+        return function(*args)
+    with password_pool_lock:
+        if password_pool is None:
+            password_pool = ProcessPoolExecutor(max_workers=app.config['PASSWORD_HASH_WORKERS'])
+    return password_pool.submit(function, *args).result()
+
+def hash_password(password):
+    return run_password_job(_hash_password, password, app.config['BCRYPT_LOG_ROUNDS'])
+
+def verify_password(password_hash, password):
+    return run_password_job(_check_password, password_hash, password)
+
+def password_needs_rehash(password_hash):
+    """Check if a bcrypt hash ($2b$<rounds>$...) was made with a different cost than configured."""
+    parts = password_hash.split('$')
+    return len(parts) > 2 and parts[2].isdigit() and int(parts[2]) != app.config['BCRYPT_LOG_ROUNDS']
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        # Attach a copy of the cached user to this request's session without a SELECT
+        return db.session.merge(cached, load=False)
+
+    user = User.query.options(joinedload(User.balance)).get(user_id)
+    if user is not None:
+        user_cache.put(user)
+    return user
 
 def is_logged_in():
     """Check if the current user is logged in."""
     return current_user.is_authenticated
 
+# Date formats used to group rows into periods, per database dialect.
+# Weeks are ISO weeks on every backend; SQLite's are built by iso_week_label.
+PERIOD_FORMATS = {
+    'sqlite': {'day': '%Y-%m-%d', 'week': None, 'month': '%Y-%m', 'year': '%Y'},
+    'postgresql': {'day': 'YYYY-MM-DD', 'week': 'IYYY-"W"IW', 'month': 'YYYY-MM', 'year': 'YYYY'},
+}
+
+def iso_week_label(column):
+    """Label a date with its ISO week as 'YYYY-Www' in SQLite, which only has %G/%V from 3.46.
+
+    An ISO week belongs to the year of its Thursday and is numbered by that
+    Thursday's day of the year, so 2023-01-01 (a Sunday) is 2022-W52.
+    """
+    # 'start of day' first: date arithmetic on times past 23:59:59.9995 rounds into the next day
+    thursday = func.date(column, 'start of day', '-3 days', 'weekday 4')
+    week = (cast(func.strftime('%j', thursday), Integer) + 6) / 7
+    return func.strftime('%Y', thursday).concat('-W').concat(func.printf('%02d', week))
+
+def period_expression(column, bucket):
+    """Return a SQL expression that labels each row with its period bucket."""
+    dialect = db.engine.dialect.name
+    fmt = PERIOD_FORMATS.get(dialect, PERIOD_FORMATS['sqlite'])[bucket]
+    if dialect == 'postgresql':
+        return func.to_char(column, fmt)
+    if fmt is None:
+        return iso_week_label(column)
+    return func.strftime(fmt, column)
+
+def parse_date_range(args):
+    """Read optional 'start' and 'end' (YYYY-MM-DD, inclusive) query arguments."""
+    start = args.get('start')
+    end = args.get('end')
+    start_date = datetime.strptime(start, '%Y-%m-%d') if start else None
+    end_date = datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1) if end else None
+    return start_date, end_date
+
+def upsert_increments(model, key_names, rows):
+    """Insert rows, or add their non-key values to the existing row with the same key.
+
+    The addition happens in SQL (SET column = column + :increment), so concurrent
+    writers never lose each other's updates. The keys must be the primary key or
+    a unique constraint. Every row must have the same attributes, given by
+    attribute name, which may differ from the column name (e.g. Money columns
+    stored as '<name>_cents'). All rows go in one executemany call.
+    """
+    table = model.__table__
+    columns = model.__mapper__.columns
+    rows = [{columns[name].name: value for name, value in row.items()} for row in rows]
+    key_columns = [columns[name].name for name in key_names]
+    insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={column: table.c[column] + stmt.excluded[column] for column in rows[0] if column not in key_columns},
+    )
+    db.session.execute(stmt, rows)
+
+def upsert_increment(model, keys, increments):
+    """Insert a row, or add the increments to the existing row with the same key, in one statement."""
+    upsert_increments(model, list(keys), [{**keys, **increments}])
+
+def add_to_summaries(user_id, records):
+    """Add (kind, amount, category, date) records to the user's rollups, inside the caller's transaction.
+
+    Records are folded together first, so a batch costs one upsert for the
+    totals and one executemany over its distinct months and categories.
+    """
+    totals = {}
+    monthly = {}
+    for kind, amount, category, date in records:
+        total_column, count_column = ('total_spent', 'expense_count') if kind == 'expense' else ('total_income', 'income_count')
+        totals[total_column] = totals.get(total_column, 0) + amount
+        totals[count_column] = totals.get(count_column, 0) + 1
+        key = (kind, date.strftime('%Y-%m'), category or '')
+        total, count = monthly.get(key, (0, 0))
+        monthly[key] = (total + amount, count + 1)
+
+    if totals:
+        upsert_increment(UserSummary, {'user_id': user_id}, totals)
+    if monthly:
+        upsert_increments(MonthlySummary, ['user_id', 'kind', 'month', 'category'], [
+            {'user_id': user_id, 'kind': kind, 'month': month, 'category': category, 'total': total, 'count': count}
+            for (kind, month, category), (total, count) in monthly.items()
+        ])
+
+def category_ids(user_id, names):
+    """Return {name: id} for the user's categories with these names, creating missing ones in the caller's transaction."""
+    names = {name for name in names if name}
+    if not names:
+        return {}
+    query = db.session.query(Category.name, Category.id).filter(Category.user_id == user_id, Category.name.in_(names))
+    ids = dict(query.all())
+    missing = names - ids.keys()
+    if missing:
+        # Another request may create the same category at the same moment; let its row win
+        insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+        stmt = insert(Category.__table__).on_conflict_do_nothing(index_elements=['user_id', 'name'])
+        db.session.execute(stmt, [{'user_id': user_id, 'name': name} for name in missing])
+        ids = dict(query.all())
+    return ids
+
+def record_in_summaries(user_id, kind, amount, category, date):
+    """Add one expense or income row to the user's rollups, inside the caller's transaction."""
+    add_to_summaries(user_id, [(kind, amount, category, date)])
+
+def bump_data_version(user_id):
+    """Advance the user's data version inside the caller's transaction, invalidating their cached responses."""
+    table = DataVersion.__table__
+    insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+    stmt = insert(table).values(user_id=user_id, version=1, updated_at=datetime.utcnow())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id'],
+        set_={'version': table.c.version + 1, 'updated_at': stmt.excluded.updated_at},
+    )
+    db.session.execute(stmt)
+
+# Compressed responses carry the ETag with the encoding appended (see compress_response)
+ETAG_ENCODING_SUFFIXES = ('', '-gzip', '-br')
+
+def conditional_on_data_version(view):
+    """Answer a per-user GET with 304 Not Modified while the user's data version is unchanged.
+
+    The strong ETag covers the user, their data version and the request path
+    with its query string. Revalidating therefore costs one primary key lookup,
+    and the view itself only runs when the data has changed.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user_id = current_user.id
+        version = db.session.query(DataVersion.version).filter_by(user_id=user_id).scalar() or 0
+        path_digest = hashlib.sha1(request.full_path.encode('utf-8')).hexdigest()[:16]
+        etag = f'{user_id}-{version}-{path_digest}'
+
+        # No Last-Modified/If-Modified-Since: whole-second dates cannot tell apart two writes in the same second
+        matched = next((etag + suffix for suffix in ETAG_ENCODING_SUFFIXES
+                        if request.if_none_match.contains(etag + suffix)), None)
+
+        if matched:
+            response = app.response_class(status=304)
+            response.set_etag(matched)
+        else:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
+
+# Page sizes for keyset-paginated listings and chunk size for streamed exports
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+EXPORT_CHUNK_SIZE = 500
+
+def encode_cursor(record):
+    """Build the opaque cursor pointing just after the given record."""
+    return f"{record.date.isoformat()},{record.id}"
+
+def keyset_query(model, user_id, cursor, limit, filters=()):
+    """Build the query for the page of records after the cursor, with one extra row to detect a next page."""
+    query = model.query.filter(model.user_id == user_id, *filters)
+    if cursor:
+        date_str, record_id = cursor.rsplit(',', 1)
+        query = query.filter(tuple_(model.date, model.id) < (datetime.fromisoformat(date_str), int(record_id)))
+    return query.order_by(model.date.desc(), model.id.desc()).limit(limit + 1)
+
+def merged_keyset_query(model, user_id, cursor, limit, branches, filters=()):
+    """Like keyset_query, for records matching any one of several lists of filters.
+
+    Each branch is paged along its own index range and only the merged page is
+    loaded, so a page of rare matches costs no more than a page of common ones.
+    """
+    pages = []
+    for branch in branches:
+        page = keyset_query(model, user_id, cursor, limit, [*filters, *branch]).with_entities(model.id, model.date).subquery()
+        pages.append(db.select(page.c.id, page.c.date))
+    merged = db.union_all(*pages).subquery()
+    newest = db.select(merged.c.id).order_by(merged.c.date.desc(), merged.c.id.desc()).limit(limit + 1)
+    return model.query.filter(model.id.in_(newest)).order_by(model.date.desc(), model.id.desc())
+
+def keyset_page(model, user_id, args, filters=(), branches=()):
+    """Return one page of a user's records, newest first, and the cursor for the next page.
+
+    Pages are keyed on (date, id) rather than OFFSET so every page is a single
+    index range scan, no matter how deep into the history it is.
+    """
+    limit = int(args.get('limit', PAGE_SIZE))
+    if limit < 1:
+        raise ValueError(f"invalid limit {limit}")
+    limit = min(limit, MAX_PAGE_SIZE)
+    if branches:
+        records = merged_keyset_query(model, user_id, args.get('cursor'), limit, branches, filters).all()
+    else:
+        records = keyset_query(model, user_id, args.get('cursor'), limit, filters).all()
+    next_cursor = encode_cursor(records[limit - 1]) if len(records) > limit else None
+    return records[:limit], next_cursor
+
+def wants_json():
+    """Check if a listing was requested as JSON rather than HTML."""
+    return request.args.get('format') == 'json'
+
 @app.route('/', methods=['GET', 'POST'])
 def login():
     logging.info("Login route accessed")
@@ -107,11 +916,22 @@ def login():
         password = request.form['password']
         logging.info(f"Attempting login for user: {username}")
 
+        # Refuse before doing any hashing work, so login bursts can't saturate the CPU.
+        # Only failed attempts count against a username, so its owner's successful logins never use up the limit
+        if login_limiter.exceeded(f"user:{username}") or not login_limiter.allow(f"ip:{request.remote_addr}"):
+            logging.info("Login rate limit exceeded")
+            return render_template('Login.html', error='Too many login attempts, please try again later'), 429
+
         user = User.query.filter_by(username=username).first()
         if user:
             logging.info("User found in database")
-            if bcrypt.check_password_hash(user.password_hash, password):
+            if verify_password(user.password_hash, password):
                 logging.info("Password matched, logging in user")
+                if password_needs_rehash(user.password_hash):
+                    # The configured cost changed since this hash was made, upgrade it now we know the password
+                    user.password_hash = hash_password(password)
+                    db.session.commit()
+                    user_cache.invalidate(user.id)
                 login_user(user)
                 return redirect(url_for('dashboard'))
             else:
@@ -119,6 +939,7 @@ def login():
         else:
             logging.info("User not found")
 
+        login_limiter.record(f"user:{username}")
         return render_template('Login.html', error='Invalid username or password')
     
     logging.info("Rendering login page")
@@ -131,9 +952,11 @@ def signup():
             username = request.form.get('username')
             password = request.form.get('password')
             email = request.form.get('email')
-            hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+            if not signup_limiter.allow(f"ip:{request.remote_addr}"):
+                return render_template('error.html', error='Too many signups, please try again later'), 429
+            hashed_password = hash_password(password)
             new_user = User(username=username, password_hash=hashed_password, email=email)
-            initial_balance = Balance(user_id=new_user.id, amount=0.0)
+            initial_balance = Balance(user_id=new_user.id, amount=0)
             db.session.add(new_user)
             db.session.commit()
 
@@ -149,33 +972,61 @@ def dashboard():
     if not is_logged_in():
         return redirect(url_for('login'))
     user_id = current_user.id
-    user_balance = Balance.query.filter_by(user_id=user_id).first()
-    balance_amount = user_balance.amount if user_balance else 0
-    transactions = Transaction.query.filter_by(user_id=current_user.id).order_by(Transaction.date.desc()).all()
-    total_spent = sum(transaction.amount for transaction in transactions)
-    return render_template('Dashboard.html', user_name=current_user.username, balance=balance_amount, transactions=transactions, total_spent=total_spent)
+    # Later pages are fetched as JSON by the infinite scroll; the page itself always starts with the newest
+    if wants_json():
+        try:
+            transactions, next_cursor = keyset_page(Transaction, user_id, request.args)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor or limit'}), 400
+        return jsonify({'items': [transaction.to_dict() for transaction in transactions], 'next_cursor': next_cursor})
+
+    # Each fragment is rendered once per data version and reused until the user's data changes
+    version = current_data_version(user_id)
+    return render_template(
+        'Dashboard.html',
+        user_name=current_user.username,
+        summary_fragment=render_fragment(user_id, 'summary', version, 'DashboardSummary.html', lambda: dashboard_summary(user_id)),
+        transactions_fragment=render_fragment(user_id, 'transactions', version, 'DashboardTransactions.html', lambda: dashboard_transactions(user_id)),
+        charts_fragment=render_fragment(user_id, 'charts', version, 'DashboardCharts.html', lambda: {'category_totals': category_totals(user_id)}),
+    )
+
+def render_fragment(user_id, name, version, template, context):
+    """Render a template fragment, or return the copy cached for the same data version; context() is only called on a miss."""
+    html = fragment_cache.get(user_id, name, version)
+    if html is None:
+        html = Markup(render_template(template, **context()))
+        fragment_cache.put(user_id, name, version, html)
+    return html
+
+def dashboard_summary(user_id):
+    user_balance = current_user.balance
+    summary = UserSummary.query.get(user_id)
+    return {
+        'balance': user_balance.amount if user_balance else 0,
+        'total_spent': summary.total_spent if summary else 0,
+    }
+
+def dashboard_transactions(user_id):
+    transactions, next_cursor = keyset_page(Transaction, user_id, {})
+    return {'transactions': transactions, 'next_cursor': next_cursor}
 
 @app.route('/add_balance', methods=['GET', 'POST'])
 @login_required
 def add_balance():
     user_id = current_user.id
-    user_balance = Balance.query.filter_by(user_id=user_id).first()
 
     if request.method == 'POST':
         # Check if it's an AJAX request
         if request.is_json:
             data = request.get_json()
-            amount_to_add = float(data['amount'])
+            amount_to_add = parse_amount(data['amount'])
         else:
-            amount_to_add = float(request.form['amount'])
+            amount_to_add = parse_amount(request.form['amount'])
 
-        # Check if the balance record exists and update it
-        if user_balance:
-            user_balance.amount += amount_to_add
-        else:
-            # If no balance record exists, create a new one
-            user_balance = Balance(user_id=user_id, amount=amount_to_add)
-            db.session.add(user_balance)
+        # Add to the balance in the database (creating it if needed) rather than in Python,
+        # so concurrent requests for the same user can't overwrite each other
+        upsert_increment(Balance, {'user_id': user_id}, {'amount': amount_to_add})
+        bump_data_version(user_id)
 
         # Commit the changes to the database
         db.session.commit()
@@ -185,9 +1036,11 @@ def add_balance():
             return jsonify({'message': 'Balance updated successfully'}), 200
         else:
             # For regular form submission, re-render the balance page with updated info
+            user_balance = Balance.query.filter_by(user_id=user_id).first()
             return render_template('Balance.html', balance=user_balance.amount)
 
     # If it's a GET request, render the balance page
+    user_balance = current_user.balance
     balance_amount = user_balance.amount if user_balance else 0
     return render_template('Balance.html', balance=balance_amount)
 
@@ -195,6 +1048,7 @@ def add_balance():
 def logout():
     if not is_logged_in():
         return redirect(url_for('login'))
+    user_cache.invalidate(current_user.id)
     logout_user()
     return redirect(url_for('login'))
 
@@ -210,25 +1064,28 @@ def add_income():
 
     try:
         # Convert the amount and date strings to their respective data types
-        amount = float(amount_str)
+        amount = parse_amount(amount_str)
         date = datetime.strptime(date_str, '%Y-%m-%d')
     except (ValueError, TypeError):
         return jsonify({'error': 'Invalid data format'}), 400
 
-    # Create new income record
-    new_income = Income(user_id=user_id, amount=amount, source=source, date=date)
-    db.session.add(new_income)
-    db.session.commit()
+    try:
+        # Create new income record and add it to the user's rollups
+        category_id = category_ids(user_id, [source]).get(source)
+        new_income = Income(user_id=user_id, amount=amount, category_id=category_id, date=date)
+        db.session.add(new_income)
+        record_in_summaries(user_id, 'income', amount, source, date)
 
-    # Update the user's balance
-    user_balance = Balance.query.filter_by(user_id=user_id).first()
-    if user_balance:
-        user_balance.amount += amount
-    else:
-        # If no balance record exists, create a new one
-        user_balance = Balance(user_id=user_id, amount=amount)
-        db.session.add(user_balance)
-    db.session.commit()
+        # Update the user's balance atomically in the database, creating it if needed
+        upsert_increment(Balance, {'user_id': user_id}, {'amount': amount})
+        bump_data_version(user_id)
+
+        # Commit the income, rollups and balance together
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error in add_income: {e}")
+        return jsonify({'error': 'An error occurred while adding the income'}), 500
 
     return jsonify({'message': 'Income record added successfully'}), 201
 
@@ -237,10 +1094,16 @@ def add_income():
 @login_required
 def get_income():
     user_id = current_user.id
-    income_records = Income.query.filter_by(user_id=user_id).all()
+    try:
+        income_records, next_cursor = keyset_page(Income, user_id, request.args)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor or limit'}), 400
+
+    if wants_json():
+        return jsonify({'items': [income.to_dict() for income in income_records], 'next_cursor': next_cursor})
 
-    # Render the 'Income.html' template and pass the income_records data to it
-    return render_template('Income.html', income_records=income_records)
+    # Render the 'Income.html' template and pass the first page of income records to it
+    return render_template('Income.html', income_records=income_records, next_cursor=next_cursor)
 
 # Add expense record
 @app.route('/expenses', methods=['POST'])
@@ -249,20 +1112,21 @@ def add_expense():
     try:
         # Extract data from the request
         user_id = current_user.id
-        amount = request.json['amount']
+        amount = parse_amount(request.json['amount'])
         category = request.json['category']
         date_str = request.json['date']
 
         # Convert the date string to a datetime object
         date = datetime.strptime(date_str, '%Y-%m-%d')
 
-        # Create a new expense record
-        new_expense = Expense(user_id=user_id, amount=amount, category=category, date=date)
+        # Create a new expense record; it also serves as the user's transaction
+        category_id = category_ids(user_id, [category]).get(category)
+        new_expense = Expense(user_id=user_id, amount=amount, category_id=category_id, date=date)
         db.session.add(new_expense)
 
-        # Additionally, create and add a transaction record
-        new_transaction = Transaction(user_id=user_id, amount=amount, category=category, date=date)
-        db.session.add(new_transaction)
+        # Keep the user's rollups in step with the new row
+        record_in_summaries(user_id, 'expense', amount, category, date)
+        bump_data_version(user_id)
 
         # Commit changes to the database
         db.session.commit()
@@ -278,6 +1142,7 @@ def add_expense():
 
 @app.route('/get_transactions')
 @login_required
+@conditional_on_data_version
 def get_transactions():
     user_id = current_user.id
     # Fetch transaction data for the current user from the database
@@ -289,6 +1154,49 @@ def get_transactions():
     # Return the transaction data as JSON
     return jsonify(transaction_data)
 
+# Get per-category spending totals, aggregated in the database
+@app.route('/get_category_totals')
+@login_required
+@conditional_on_data_version
+def get_category_totals():
+    bucket = request.args.get('bucket')
+    if bucket and bucket not in PERIOD_FORMATS['sqlite']:
+        return jsonify({'error': 'Invalid bucket, expected one of: day, week, month, year'}), 400
+
+    try:
+        start_date, end_date = parse_date_range(request.args)
+    except ValueError:
+        return jsonify({'error': 'Invalid date format, expected YYYY-MM-DD'}), 400
+
+    return jsonify(category_totals(current_user.id, start_date, end_date, bucket))
+
+def category_totals(user_id, start_date=None, end_date=None, bucket=None):
+    """Return the user's spending total and count per category, optionally per period of the given bucket."""
+    columns = [
+        Category.name.label('category'),
+        func.sum(Transaction.amount).label('total'),
+        func.count(Transaction.id).label('count'),
+    ]
+    if bucket:
+        columns.insert(0, period_expression(Transaction.date, bucket).label('period'))
+
+    # Rows are grouped by category id, and the names are joined in once per group
+    query = db.session.query(*columns).select_from(Transaction) \
+        .outerjoin(Category, Transaction.category_id == Category.id) \
+        .filter(Transaction.user_id == user_id)
+    if start_date:
+        query = query.filter(Transaction.date >= start_date)
+    if end_date:
+        query = query.filter(Transaction.date < end_date)
+
+    if bucket:
+        query = query.group_by('period', Transaction.category_id, Category.name).order_by('period', Category.name)
+        totals = [{'period': row.period, 'category': row.category, 'total': row.total, 'count': row.count} for row in query]
+    else:
+        query = query.group_by(Transaction.category_id, Category.name).order_by(Category.name)
+        totals = [{'category': row.category, 'total': row.total, 'count': row.count} for row in query]
+    return totals
+
 # Get expense records
 @app.route('/expenses', methods=['GET'])
 @login_required
@@ -296,13 +1204,19 @@ def get_expenses():
     try:
         # Assume user_id is retrieved from request or session
         user_id = current_user.id
-        expenses = Expense.query.filter_by(user_id=user_id).all()
+        expenses, next_cursor = keyset_page(Expense, user_id, request.args)
 
         # Convert expenses to a suitable format if necessary
         expenses_data = [expense.to_dict() for expense in expenses]
 
-        # Render the Expense.html template, passing in the expenses data
-        return render_template('Expense.html', expenses=expenses_data)
+        if wants_json():
+            return jsonify({'items': expenses_data, 'next_cursor': next_cursor})
+
+        # Render the Expense.html template, passing in the first page of expenses
+        return render_template('Expense.html', expenses=expenses_data, next_cursor=next_cursor)
+
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor or limit'}), 400
 
     except Exception as e:
         # Log the exception for debugging
@@ -314,19 +1228,902 @@ def get_expenses():
     # return render_template('Expense.html', expenses=[])
 
 
-# Get transactions by category
+# Text searches matching more categories than this walk the date index instead of one range per category
+SEARCH_MAX_BRANCHES = 100
+
+def category_search_query(user_id, text):
+    """Build the query for the ids of the user's categories with a word starting with each word of the text.
+
+    On SQLite this is an FTS5 match, where words are also stemmed, so 'grocery'
+    finds 'Groceries'. Elsewhere it falls back to substring matches, which only
+    have to scan the user's own category names.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        raise ValueError(f"no words to search for in {text!r}")
+    if db.engine.dialect.name == 'sqlite':
+        terms = ' AND '.join(f'"{word}"*' for word in words)
+        match = f'owner:"u{user_id}" AND name:({terms})'
+        return db.session.query(db.literal_column('rowid')).select_from(db.table('category_search')) \
+            .filter(db.text('category_search MATCH :match').bindparams(match=match))
+    return db.session.query(Category.id).filter(Category.user_id == user_id, *[Category.name.ilike(f'%{word}%') for word in words])
+
+# Search the user's expenses and income by category or source text, amount and date, newest first
+@app.route('/search', methods=['GET'])
+@login_required
+@conditional_on_data_version
+def search():
+    user_id = current_user.id
+    kind = request.args.get('type')
+    if kind and kind not in ('expense', 'income'):
+        return jsonify({'error': 'Invalid type, expected expense or income'}), 400
+    try:
+        start_date, end_date = parse_date_range(request.args)
+    except ValueError:
+        return jsonify({'error': 'Invalid date format, expected YYYY-MM-DD'}), 400
+    try:
+        min_amount = parse_amount(request.args['min_amount']) if request.args.get('min_amount') else None
+        max_amount = parse_amount(request.args['max_amount']) if request.args.get('max_amount') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid amount'}), 400
+
+    filters = []
+    branches = []
+    kinds = [kind] if kind else ['expense', 'income']
+    if request.args.get('q'):
+        try:
+            matching_ids = [row[0] for row in category_search_query(user_id, request.args['q'])]
+        except ValueError:
+            return jsonify({'error': 'Search text must contain a letter or digit'}), 400
+        if not matching_ids:
+            return jsonify({'items': [], 'next_cursor': None})
+        if len(matching_ids) * len(kinds) <= SEARCH_MAX_BRANCHES:
+            # One (user_id, kind, category_id, date) index range per kind and category
+            branches = [[LedgerEntry.kind == k, LedgerEntry.category_id == category_id]
+                        for k in kinds for category_id in matching_ids]
+        else:
+            filters.append(LedgerEntry.category_id.in_(matching_ids))
+    if kind and not branches:
+        filters.append(LedgerEntry.kind == kind)
+    if start_date:
+        filters.append(LedgerEntry.date >= start_date)
+    if end_date:
+        filters.append(LedgerEntry.date < end_date)
+    if min_amount is not None:
+        filters.append(LedgerEntry.amount >= min_amount)
+    if max_amount is not None:
+        filters.append(LedgerEntry.amount <= max_amount)
+
+    try:
+        entries, next_cursor = keyset_page(LedgerEntry, user_id, request.args, filters, branches)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor or limit'}), 400
+
+    return jsonify({'items': [dict(entry.to_dict(), type=entry.kind) for entry in entries], 'next_cursor': next_cursor})
+
+# Drill into one category: its total and count, and a page of its transactions, newest first
 @app.route('/transactions/<category>', methods=['GET'])
 @login_required
+@conditional_on_data_version
 def transactions_by_category(category):
-    user_id = request.args.get('user_id')
+    user_id = current_user.id
+    try:
+        start_date, end_date = parse_date_range(request.args)
+    except ValueError:
+        return jsonify({'error': 'Invalid date format, expected YYYY-MM-DD'}), 400
+
+    category_id = db.session.query(Category.id).filter_by(user_id=user_id, name=category).scalar()
+    if category_id is None:
+        return jsonify({'category': category, 'total': 0, 'count': 0, 'items': [], 'next_cursor': None})
+
+    # Every filter is on the (user_id, kind, category_id, date) index
+    filters = [Transaction.category_id == category_id]
+    if start_date:
+        filters.append(Transaction.date >= start_date)
+    if end_date:
+        filters.append(Transaction.date < end_date)
+
+    try:
+        transactions, next_cursor = keyset_page(Transaction, user_id, request.args, filters)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor or limit'}), 400
+
+    total, count = db.session.query(func.coalesce(func.sum(Transaction.amount), 0), func.count(Transaction.id)) \
+        .filter(Transaction.user_id == user_id, *filters).one()
+
+    return jsonify({
+        'category': category,
+        'total': total,
+        'count': count,
+        'items': [transaction.to_dict() for transaction in transactions],
+        'next_cursor': next_cursor,
+    })
+
+# Budget periods: calendar month, calendar week (Monday to Sunday) or the last 30 days
+BUDGET_PERIODS = ('month', 'week', 'rolling30')
+
+def budget_period_bounds(period, anchor):
+    """Return the [start, end) datetimes of the budget period containing the anchor date."""
+    day = datetime(anchor.year, anchor.month, anchor.day)
+    if period == 'month':
+        start = day.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+    elif period == 'week':
+        start = day - timedelta(days=day.weekday())
+        end = start + timedelta(days=7)
+    else:
+        end = day + timedelta(days=1)
+        start = end - timedelta(days=30)
+    return start, end
+
+def budget_spending(start, end, user_id=None):
+    """Spend against every budget in [start, end), for one user or for all users, in one grouped query."""
+    spent = func.coalesce(func.sum(Transaction.amount), 0).label('spent')
+    query = db.session.query(Budget.id, Budget.user_id, Budget.category, Budget.limit, spent).outerjoin(
+        Category,
+        and_(Category.user_id == Budget.user_id, Category.name == Budget.category),
+    ).outerjoin(
+        Transaction,
+        and_(
+            Transaction.user_id == Budget.user_id,
+            Transaction.category_id == Category.id,
+            Transaction.date >= start,
+            Transaction.date < end,
+        ),
+    )
+    if user_id is not None:
+        query = query.filter(Budget.user_id == user_id)
+    return query.group_by(Budget.id, Budget.user_id, Budget.category, Budget.limit).order_by(Budget.user_id, Budget.category)
+
+def budget_status(row):
+    return {
+        'id': row.id,
+        'category': row.category,
+        'limit': row.limit,
+        'spent': row.spent,
+        'remaining': row.limit - row.spent,
+        'percent_used': round(row.spent / row.limit * 100, 1) if row.limit else None,
+        'over_budget': row.spent > row.limit,
+    }
+
+def requested_budget_period(args):
+    """Read the budget period from 'start'/'end', or from 'period' and an optional anchor 'date'."""
+    start, end = parse_date_range(args)
+    if start and end:
+        return 'custom', start, end
+    period = args.get('period', 'month')
+    if period not in BUDGET_PERIODS:
+        raise ValueError(f"Invalid period, expected one of: {', '.join(BUDGET_PERIODS)}")
+    anchor = datetime.strptime(args['date'], '%Y-%m-%d') if args.get('date') else datetime.utcnow()
+    start, end = budget_period_bounds(period, anchor)
+    return period, start, end
+
+# Get spend against each of the user's budgets
+@app.route('/budgets', methods=['GET'])
+@login_required
+def get_budgets():
+    try:
+        period, start, end = requested_budget_period(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    budgets = [budget_status(row) for row in budget_spending(start, end, current_user.id)]
+    return jsonify({
+        'period': period,
+        'start': start.date().isoformat(),
+        'end': (end - timedelta(days=1)).date().isoformat(),
+        'budgets': budgets,
+    })
+
+# Set the limit for one of the user's budget categories
+@app.route('/budgets', methods=['POST'])
+@login_required
+def set_budget():
+    try:
+        category = request.json['category']
+        limit = parse_amount(request.json['limit'])
+    except (KeyError, ValueError, TypeError):
+        return jsonify({'error': 'Invalid data format'}), 400
+
+    budget = Budget.query.filter_by(user_id=current_user.id, category=category).first()
+    if budget:
+        budget.limit = limit
+    else:
+        db.session.add(Budget(user_id=current_user.id, category=category, limit=limit))
+    db.session.commit()
+    return jsonify({'message': 'Budget saved successfully'}), 200
+
+@app.cli.command('evaluate-budgets')
+@click.option('--period', type=click.Choice(BUDGET_PERIODS), default='month', show_default=True)
+@click.option('--date', 'anchor', type=click.DateTime(formats=['%Y-%m-%d']), help='Day inside the period, defaults to today.')
+def evaluate_budgets(period, anchor):
+    """Report every over-budget category for all users, with a single grouped query."""
+    start, end = budget_period_bounds(period, anchor or datetime.utcnow())
+    evaluated = 0
+    over = 0
+    for row in budget_spending(start, end):
+        evaluated += 1
+        if row.spent > row.limit:
+            over += 1
+            print(f"user {row.user_id} {row.category}: spent {row.spent:.2f} of {row.limit:.2f}")
+    print(f"{over} of {evaluated} budget(s) over their limit for {start:%Y-%m-%d} to {end - timedelta(days=1):%Y-%m-%d}")
+
+# Complete months of cash flow that goal projections are based on
+CASHFLOW_MONTHS = 12
+# Months averaged for the rolling-average projection
+CASHFLOW_AVERAGE_MONTHS = 6
+# Projections further out than this are reported as unreachable
+MAX_PROJECTION_MONTHS = 600
+
+# Cash flow statistics per user, keyed by the user's data version and the current month
+cashflow_cache = {}
+cashflow_cache_lock = threading.Lock()
+
+def month_start(date, months_back=0):
+    """Return the first day of the month that is months_back months before the date's month."""
+    index = date.year * 12 + date.month - 1 - months_back
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def monthly_cashflow(user_id, today):
+    """Income minus expenses for each of the last CASHFLOW_MONTHS complete months, oldest first.
+
+    Read from the monthly rollups, so the cost depends on the number of months
+    and categories rather than the number of transactions.
+    """
+    first = month_start(today, CASHFLOW_MONTHS)
+    months = [month_start(today, back).strftime('%Y-%m') for back in range(CASHFLOW_MONTHS, 0, -1)]
+    rows = db.session.query(MonthlySummary.month, MonthlySummary.kind, func.sum(MonthlySummary.total)) \
+        .filter(MonthlySummary.user_id == user_id, MonthlySummary.month >= first.strftime('%Y-%m'),
+                MonthlySummary.month < today.strftime('%Y-%m')) \
+        .group_by(MonthlySummary.month, MonthlySummary.kind)
+
+    net = dict.fromkeys(months, 0.0)
+    for month, kind, total in rows:
+        net[month] += float(total) if kind == 'income' else -float(total)
+
+    # Ignore the months before the user's history starts, they would drag the average towards zero
+    series = [net[month] for month in months]
+    while series and series[0] == 0.0:
+        series.pop(0)
+    return series
+
+def cashflow_stats(user_id, today):
+    """Return the rolling average and linear trend of the user's monthly cash flow, cached until it changes."""
+    # rebuild-summaries can correct totals without adding rows, but it advances the data version too
+    version = (current_data_version(user_id), today.strftime('%Y-%m'))
+    with cashflow_cache_lock:
+        cached = cashflow_cache.get(user_id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    series = monthly_cashflow(user_id, today)
+    recent = series[-CASHFLOW_AVERAGE_MONTHS:]
+    stats = {
+        'months': len(series),
+        'average': sum(recent) / len(recent) if recent else 0.0,
+        'intercept': 0.0,
+        'slope': 0.0,
+    }
+    if len(series) >= 2:
+        # Least-squares line through (month index, net cash flow)
+        n = len(series)
+        mean_x = (n - 1) / 2
+        mean_y = sum(series) / n
+        stats['slope'] = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(series)) / sum((x - mean_x) ** 2 for x in range(n))
+        stats['intercept'] = mean_y - stats['slope'] * mean_x
+    elif series:
+        stats['intercept'] = series[0]
+
+    with cashflow_cache_lock:
+        if len(cashflow_cache) >= app.config['USER_CACHE_SIZE']:
+            cashflow_cache.clear()
+        cashflow_cache[user_id] = (version, stats)
+    return stats
+
+def months_to_reach(remaining, stats):
+    """Months until the remaining amount is saved, by rolling average and by linear trend (None if never)."""
+    if remaining <= 0:
+        return 0.0, 0
+    average = remaining / stats['average'] if stats['average'] > 0 else None
+
+    trend = None
+    saved = 0.0
+    for month in range(1, MAX_PROJECTION_MONTHS + 1):
+        saved += max(stats['intercept'] + stats['slope'] * (stats['months'] - 1 + month), 0.0)
+        if saved >= remaining:
+            trend = month
+            break
+    if average is not None and average > MAX_PROJECTION_MONTHS:
+        average = None
+    return average, trend
+
+def projected_date(today, months):
+    return (today + timedelta(days=round(months * 30.44))).date().isoformat() if months is not None else None
+
+def goal_projection(goal, stats, today):
+    remaining = goal.target_amount - (goal.current_amount or 0)
+    average_months, trend_months = months_to_reach(float(remaining), stats)
+    projection = goal.to_dict()
+    projection.update({
+        'remaining': max(remaining, Decimal(0)),
+        'projected_completion_average': projected_date(today, average_months),
+        'projected_completion_trend': projected_date(today, trend_months),
+    })
+    if goal.deadline:
+        completion = projection['projected_completion_average']
+        projection['on_track'] = completion is not None and completion <= goal.deadline.date().isoformat()
+    return projection
+
+# Get the user's savings goals with projected completion dates
+@app.route('/goals', methods=['GET'])
+@login_required
+def get_goals():
+    today = datetime.utcnow()
+    stats = cashflow_stats(current_user.id, today)
+    goals = SavingsGoal.query.filter_by(user_id=current_user.id).order_by(SavingsGoal.id).all()
+    return jsonify({
+        'monthly_cashflow_average': stats['average'],
+        'monthly_cashflow_trend': stats['slope'],
+        'months_of_history': stats['months'],
+        'goals': [goal_projection(goal, stats, today) for goal in goals],
+    })
+
+# Add a savings goal
+@app.route('/goals', methods=['POST'])
+@login_required
+def add_goal():
+    try:
+        target_amount = parse_amount(request.json['target_amount'])
+        current_amount = parse_amount(request.json.get('current_amount') or 0)
+        deadline_str = request.json.get('deadline')
+        deadline = datetime.strptime(deadline_str, '%Y-%m-%d') if deadline_str else None
+    except (KeyError, ValueError, TypeError):
+        return jsonify({'error': 'Invalid data format'}), 400
+
+    goal = SavingsGoal(user_id=current_user.id, target_amount=target_amount, current_amount=current_amount, deadline=deadline)
+    db.session.add(goal)
+    db.session.commit()
+    return jsonify(goal.to_dict()), 201
+
+# Models that can be exported, keyed by the name used in the export URL
+EXPORT_MODELS = {
+    'expenses': Expense,
+    'income': Income,
+    'transactions': Transaction,
+}
+
+# Stream all of a user's records as newline-delimited JSON
+@app.route('/export/<kind>', methods=['GET'])
+@login_required
+def export_records(kind):
+    model = EXPORT_MODELS.get(kind)
+    if model is None:
+        return jsonify({'error': 'Unknown export type'}), 404
+    user_id = current_user.id
+
+    def generate():
+        # Rows are fetched and serialised in chunks so memory stays flat however long the history is
+        query = model.query.filter_by(user_id=user_id).order_by(model.date, model.id).yield_per(EXPORT_CHUNK_SIZE)
+        chunk = []
+        for record in query:
+            chunk.append(json.dumps(record.to_dict(), default=json_default))
+            if len(chunk) == EXPORT_CHUNK_SIZE:
+                yield '\n'.join(chunk) + '\n'
+                chunk = []
+        if chunk:
+            yield '\n'.join(chunk) + '\n'
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename={kind}.ndjson'
+    return response
+
+REPORT_FORMATS = ('csv', 'html', 'pdf')
+REPORT_MIMETYPES = {'csv': 'text/csv', 'html': 'text/html', 'pdf': 'application/pdf'}
+ACTIVE_REPORT_STATUSES = ('pending', 'running')
+
+def current_data_version(user_id):
+    version = db.session.query(DataVersion.version).filter_by(user_id=user_id).scalar()
+    return version or 0
+
+def month_bounds(month):
+    """Return the [start, end) datetimes of a 'YYYY-MM' month, raising ValueError for anything else."""
+    if not re.fullmatch(r'\d{4}-\d{2}', month or ''):
+        raise ValueError(f"invalid month {month!r}")
+    start = datetime.strptime(month, '%Y-%m')
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+def request_report(user_id, month, fmt):
+    """Queue a statement job and return (job, created).
+
+    An identical job that is still queued or running is returned instead of a
+    new one, as is a finished job whose file was generated from the user's
+    current data, so month-end bursts of the same request cost one generation.
+    """
+    version = current_data_version(user_id)
+    candidates = ReportJob.query.filter(
+        ReportJob.user_id == user_id, ReportJob.month == month, ReportJob.fmt == fmt,
+        or_(ReportJob.status.in_(ACTIVE_REPORT_STATUSES),
+            and_(ReportJob.status == 'done', ReportJob.data_version == version)),
+    ).order_by(ReportJob.id.desc())
+    for job in candidates:
+        if job.status != 'done' or os.path.exists(job.path):
+            return job, False
+
+    job = ReportJob(user_id=user_id, month=month, fmt=fmt, data_version=version)
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request queued the same statement between the check and the insert
+        db.session.rollback()
+        job = ReportJob.query.filter(
+            ReportJob.user_id == user_id, ReportJob.month == month, ReportJob.fmt == fmt,
+            ReportJob.status.in_(ACTIVE_REPORT_STATUSES),
+        ).first()
+        return job, False
+    return job, True
+
+def statement_entries(user_id, month):
+    """A user's expenses and income for one month, oldest first, fetched in chunks."""
+    start, end = month_bounds(month)
+    return (LedgerEntry.query
+            .filter(LedgerEntry.user_id == user_id, LedgerEntry.kind.in_(('expense', 'income')),
+                    LedgerEntry.date >= start, LedgerEntry.date < end)
+            .order_by(LedgerEntry.date, LedgerEntry.id)
+            .yield_per(EXPORT_CHUNK_SIZE))
+
+def write_csv_statement(job, stream):
+    writer = csv.writer(stream)
+    writer.writerow(['date', 'type', 'category', 'amount'])
+    for entry in statement_entries(job.user_id, job.month):
+        writer.writerow([entry.date.strftime('%Y-%m-%d'), entry.kind, entry.category or '', f"{entry.amount:.2f}"])
+
+def render_statement_html(job):
+    """Render the statement page, with income, expense and per-category totals for the month."""
+    entries = list(statement_entries(job.user_id, job.month))
+    income = sum((entry.amount for entry in entries if entry.kind == 'income'), Decimal(0))
+    expenses = sum((entry.amount for entry in entries if entry.kind == 'expense'), Decimal(0))
+    categories = {}
+    for entry in entries:
+        if entry.kind == 'expense':
+            categories[entry.category or 'Uncategorized'] = categories.get(entry.category or 'Uncategorized', Decimal(0)) + entry.amount
+    user = User.query.get(job.user_id)
+    return render_template(
+        'Statement.html', user_name=user.username, month=job.month, entries=entries,
+        total_income=income, total_expenses=expenses, net=income - expenses,
+        categories=sorted(categories.items(), key=lambda item: item[1], reverse=True),
+        generated_at=datetime.utcnow(),
+    )
+
+def generate_statement(job):
+    """Write the job's statement file and return its path.
+
+    Every attempt writes its own temporary file and renames it to a name of its
+    own, so a download never sees a half-written statement, and a worker that
+    re-claimed an overrunning job never writes into the first worker's file.
+    """
+    os.makedirs(app.config['REPORT_DIR'], exist_ok=True)
+    fd, partial = tempfile.mkstemp(prefix=f"{job.user_id}-{job.month}-{job.id}-", suffix=f".{job.fmt}.partial",
+                                   dir=app.config['REPORT_DIR'])
+    path = partial[:-len('.partial')]
+    try:
+        if job.fmt == 'csv':
+            with open(fd, 'w', encoding='utf-8', newline='') as stream:
+                write_csv_statement(job, stream)
+        elif job.fmt == 'html':
+            with open(fd, 'w', encoding='utf-8') as stream:
+                stream.write(render_statement_html(job))
+        else:
+            os.close(fd)
+            if PdfDocument is None:
+                raise RuntimeError('PDF statements need the weasyprint package')
+            PdfDocument(string=render_statement_html(job)).write_pdf(partial)
+        os.replace(partial, path)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return path
+
+def claim_report_job():
+    """Mark the oldest queued job, or one whose worker stopped responding, as running and return it.
+
+    The UPDATE re-checks the job's state, so when several workers race for the
+    same job exactly one of them claims it.
+    """
+    stale = datetime.utcnow() - timedelta(seconds=app.config['REPORT_JOB_TIMEOUT'])
+    claimable = or_(ReportJob.status == 'pending', and_(ReportJob.status == 'running', ReportJob.started_at < stale))
+    for job_id, in db.session.query(ReportJob.id).filter(claimable).order_by(ReportJob.id).limit(10).all():
+        claimed = (ReportJob.query.filter(ReportJob.id == job_id, claimable)
+                   .update({'status': 'running', 'started_at': datetime.utcnow()}, synchronize_session=False))
+        db.session.commit()
+        if claimed:
+            return ReportJob.query.get(job_id)
+    return None
+
+def run_report_job(job):
+    """Generate a claimed job's statement and record whether it succeeded.
+
+    A job that overruns REPORT_JOB_TIMEOUT can be claimed again by another
+    worker, so the result is only recorded while the job still carries this
+    attempt's started_at. Returns False when the attempt was superseded.
+    """
+    started_at = job.started_at
+    path = None
+    try:
+        version = current_data_version(job.user_id)
+        path = generate_statement(job)
+        result = {'status': 'done', 'path': path, 'data_version': version, 'error': None}
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error in report job {job.id}: {e}")
+        result = {'status': 'failed', 'error': str(e)[:255]}
+    result['finished_at'] = datetime.utcnow()
+    owned = (ReportJob.query.filter_by(id=job.id, status='running', started_at=started_at)
+             .update(result, synchronize_session=False))
+    db.session.commit()
+    if not owned:
+        app.logger.warning(f"Report job {job.id} was claimed again by another worker, discarding this attempt")
+        if path:
+            os.remove(path)
+    return bool(owned)
+
+# Request a monthly statement; it is generated in the background by `flask report-worker`
+@app.route('/reports', methods=['POST'])
+@login_required
+def create_report():
+    data = request.get_json(silent=True) or {}
+    month = data.get('month')
+    fmt = (data.get('format') or 'csv').lower()
+    try:
+        month_bounds(month)
+    except ValueError:
+        return jsonify({'error': 'Invalid month, expected YYYY-MM'}), 400
+    if fmt not in REPORT_FORMATS:
+        return jsonify({'error': f"Invalid format, expected one of: {', '.join(REPORT_FORMATS)}"}), 400
+    if fmt == 'pdf' and PdfDocument is None:
+        return jsonify({'error': 'PDF statements are not available on this server, use html'}), 400
+
+    try:
+        job, created = request_report(current_user.id, month, fmt)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error in create_report: {e}")
+        return jsonify({'error': 'An error occurred while requesting the statement'}), 500
+
+    status = 200 if job.status == 'done' else 202
+    response = jsonify(job.to_dict())
+    response.status_code = status
+    response.headers['Location'] = url_for('get_report', job_id=job.id)
+    return response
+
+# List the user's most recent statement requests
+@app.route('/reports', methods=['GET'])
+@login_required
+def list_reports():
+    jobs = (ReportJob.query.filter_by(user_id=current_user.id)
+            .order_by(ReportJob.created_at.desc()).limit(PAGE_SIZE).all())
+    return jsonify({'reports': [job.to_dict() for job in jobs]})
+
+# Poll the status of one statement request
+@app.route('/reports/<int:job_id>', methods=['GET'])
+@login_required
+def get_report(job_id):
+    job = ReportJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if job is None:
+        return jsonify({'error': 'Report not found'}), 404
+    return jsonify(job.to_dict())
+
+# Download a finished statement
+@app.route('/reports/<int:job_id>/download', methods=['GET'])
+@login_required
+def download_report(job_id):
+    job = ReportJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if job is None:
+        return jsonify({'error': 'Report not found'}), 404
+    if job.status != 'done':
+        return jsonify({'error': f"Report is {job.status}", 'status': job.status}), 409
+    if not os.path.exists(job.path):
+        return jsonify({'error': 'Report file is no longer available, request it again'}), 410
+    return send_file(job.path, mimetype=REPORT_MIMETYPES[job.fmt], as_attachment=True,
+                     download_name=f"statement-{job.month}.{job.fmt}")
+
+@app.cli.command('report-worker')
+@click.option('--once', is_flag=True, help='Exit once the queue is empty instead of waiting for new jobs.')
+def report_worker(once):
+    """Generate queued statements, polling the report_job table for new ones."""
+    print(f"Report worker writing to {app.config['REPORT_DIR']}")
+    processed = 0
+    while True:
+        job = claim_report_job()
+        if job is None:
+            if once:
+                break
+            time.sleep(app.config['REPORT_POLL_INTERVAL'])
+            continue
+        started = time.perf_counter()
+        status = job.status if run_report_job(job) else 'superseded'
+        processed += 1
+        print(f"job {job.id} ({job.month} {job.fmt} for user {job.user_id}): {status} in {time.perf_counter() - started:.2f}s")
+    print(f"Processed {processed} job(s)")
+
+# Statement rows are inserted this many at a time, one transaction per batch
+IMPORT_BATCH_SIZE = 1000
+# Only the first few invalid rows are reported back, the rest are just counted
+MAX_IMPORT_ERRORS = 100
+
+def parse_csv_statement(stream):
+    """Yield (line number, row) from a CSV statement with date, amount and category/description columns."""
+    reader = csv.DictReader(stream)
+    for row in reader:
+        row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+        yield reader.line_num, {
+            'date': row.get('date'),
+            'amount': row.get('amount'),
+            'category': row.get('category') or row.get('description'),
+            'type': row.get('type'),
+        }
+
+OFX_TRANSACTION = re.compile(r'<STMTTRN>(.*?)</STMTTRN>', re.S | re.I)
+OFX_TAG = re.compile(r'<(\w+)>([^<\r\n]*)')
+
+def parse_ofx_statement(stream):
+    """Yield (line number, row) for each <STMTTRN> block of an OFX statement.
+
+    Blocks are found by their tags rather than by line, so minified OFX with
+    everything on one line imports too. Only the text from the last unclosed
+    <STMTTRN> onwards is kept between lines.
+    """
+    buffer = ''
+    buffer_line = 1
+    for line in stream:
+        buffer += line
+        end = 0
+        for match in OFX_TRANSACTION.finditer(buffer):
+            # SGML OFX escapes &, < and > in values as entities, e.g. AT&amp;T
+            transaction = {tag.upper(): html.unescape(value).strip() for tag, value in OFX_TAG.findall(match.group(1))}
+            posted = transaction.get('DTPOSTED', '')
+            yield buffer_line + buffer.count('\n', 0, match.start()), {
+                'date': f"{posted[:4]}-{posted[4:6]}-{posted[6:8]}" if len(posted) >= 8 else posted,
+                'amount': transaction.get('TRNAMT'),
+                'category': transaction.get('NAME') or transaction.get('MEMO'),
+                'type': None,
+            }
+            end = match.end()
+        start = buffer.upper().find('<STMTTRN>', end)
+        keep = start if start != -1 else len(buffer)
+        buffer_line += buffer.count('\n', 0, keep)
+        buffer = buffer[keep:]
 
-    # Fetch transactions for the given category and user
-    transactions = Transaction.query.filter_by(user_id=user_id, category=category).all()
+class UnreadableStatement(ValueError):
+    """A statement that can't be decoded or parsed from the given line on."""
 
-    # Convert transactions to a JSON-serializable format
-    transactions_data = [transaction.to_dict() for transaction in transactions]
+    def __init__(self, line, message):
+        super().__init__(message)
+        self.line = line
 
-    return jsonify(transactions_data), 200
+def decoded_lines(binary):
+    """Decode a statement file line by line, so an invalid byte is reported with its line number."""
+    for line_number, raw in enumerate(binary, start=1):
+        try:
+            yield raw.decode('utf-8-sig' if line_number == 1 else 'utf-8')
+        except UnicodeDecodeError as e:
+            raise UnreadableStatement(line_number, f"line {line_number} is not valid UTF-8 (byte {e.start + 1})")
+
+STATEMENT_PARSERS = {
+    'csv': parse_csv_statement,
+    'ofx': parse_ofx_statement,
+}
+
+def validate_statement_row(row):
+    """Turn a parsed statement row into (kind, amount, category, date) or raise ValueError.
+
+    Without an explicit type column, negative amounts are expenses and positive amounts income.
+    """
+    if not row['date'] or not row['amount']:
+        raise ValueError('date and amount are required')
+    date = datetime.strptime(row['date'], '%Y-%m-%d')
+    amount = parse_amount(row['amount'])
+
+    kind = (row['type'] or '').lower()
+    if not kind:
+        kind = 'expense' if amount < 0 else 'income'
+    if kind not in ('expense', 'income'):
+        raise ValueError(f"unknown type {row['type']!r}")
+    if amount == 0:
+        raise ValueError('amount must not be zero')
+
+    category = (row['category'] or 'Uncategorized')[:100]
+    return kind, abs(amount), category, date
+
+def flush_import_batch(user_id, batch):
+    """Insert one batch of validated rows, with its rollups and balance change, as a single transaction."""
+    ids = category_ids(user_id, {category for kind, amount, category, date in batch})
+    entries = [{'user_id': user_id, 'kind': kind, 'amount': amount, 'category_id': ids.get(category), 'date': date}
+               for kind, amount, category, date in batch]
+
+    db.session.bulk_insert_mappings(LedgerEntry, entries)
+    add_to_summaries(user_id, batch)
+
+    # Income adds to the balance, matching add_income; expenses leave it alone, matching add_expense
+    income_total = sum(entry['amount'] for entry in entries if entry['kind'] == 'income')
+    if income_total:
+        upsert_increment(Balance, {'user_id': user_id}, {'amount': income_total})
+    bump_data_version(user_id)
+
+    db.session.commit()
+    expenses = sum(1 for entry in entries if entry['kind'] == 'expense')
+    return expenses, len(entries) - expenses
+
+def import_statement(user_id, stream, fmt):
+    """Validate and insert every row of a statement in batches, returning a summary of the import.
+
+    Each batch is committed on its own. If the statement turns out to be
+    unreadable part way through, the unfinished batch is dropped and the
+    summary gets an 'error' with its line and 'imported_through_line', the
+    last line whose batch was committed, so the rest can be imported later.
+    """
+    result = {'expenses': 0, 'income': 0, 'batches': 0, 'invalid_rows': 0, 'errors': []}
+    batch = []
+    line_number = 0
+    committed_line = 0
+
+    def flush():
+        nonlocal committed_line
+        expenses, incomes = flush_import_batch(user_id, batch)
+        result['expenses'] += expenses
+        result['income'] += incomes
+        result['batches'] += 1
+        committed_line = line_number
+        batch.clear()
+
+    try:
+        for line_number, row in STATEMENT_PARSERS[fmt](stream):
+            try:
+                batch.append(validate_statement_row(row))
+            except (ValueError, TypeError) as e:
+                result['invalid_rows'] += 1
+                if len(result['errors']) < MAX_IMPORT_ERRORS:
+                    result['errors'].append({'line': line_number, 'error': str(e)})
+                continue
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush()
+    except (UnreadableStatement, csv.Error) as e:
+        result['error'] = {'line': getattr(e, 'line', line_number + 1), 'error': str(e)}
+        result['imported_through_line'] = committed_line
+        return result
+
+    if batch:
+        flush()
+    return result
+
+def statement_format(filename, requested=None):
+    """Pick the statement parser from an explicit format or the file extension."""
+    fmt = (requested or os.path.splitext(filename or '')[1].lstrip('.')).lower()
+    if fmt not in STATEMENT_PARSERS:
+        raise ValueError('Unsupported statement format, expected csv or ofx')
+    return fmt
+
+# Bulk import a bank statement upload (CSV or OFX)
+@app.route('/import', methods=['POST'])
+@login_required
+def import_records():
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify({'error': 'No statement file uploaded'}), 400
+
+    try:
+        fmt = statement_format(upload.filename, request.form.get('format'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        result = import_statement(current_user.id, decoded_lines(upload.stream), fmt)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error in import_records: {e}")
+        return jsonify({'error': 'An error occurred while importing the statement'}), 500
+
+    # Batches before an unreadable line are already committed; say how far the import got
+    if 'error' in result:
+        return jsonify(result), 207 if result['batches'] else 400
+    if fmt == 'ofx' and not (result['expenses'] or result['income'] or result['invalid_rows']):
+        return jsonify({'error': 'No transactions found in the OFX statement'}), 400
+    return jsonify(result), 201
+
+@app.cli.command('import-statement')
+@click.argument('username')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(sorted(STATEMENT_PARSERS)), help='Defaults to the file extension.')
+def import_statement_command(username, path, fmt):
+    """Bulk import a CSV or OFX bank statement for a user."""
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f"No user named {username!r}")
+    try:
+        fmt = statement_format(path, fmt)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    with open(path, 'rb') as stream:
+        result = import_statement(user.id, decoded_lines(stream), fmt)
+
+    print(f"Imported {result['expenses']} expense(s) and {result['income']} income record(s) in {result['batches']} batch(es)")
+    for error in result['errors']:
+        print(f"line {error['line']}: {error['error']}")
+    if result['invalid_rows'] > len(result['errors']):
+        print(f"... and {result['invalid_rows'] - len(result['errors'])} more invalid row(s)")
+    if 'error' in result:
+        raise click.ClickException(f"Stopped at line {result['error']['line']}: {result['error']['error']}. "
+                                   f"Lines up to {result['imported_through_line']} were imported.")
+
+def expected_summaries():
+    """Recompute every user's rollups from the raw Transaction and Income rows."""
+    user_totals = {}
+    monthly = {}
+
+    for kind, model in (('expense', Transaction), ('income', Income)):
+        total_columns = ('total_spent', 'expense_count') if kind == 'expense' else ('total_income', 'income_count')
+        rows = db.session.query(model.user_id, func.sum(model.amount), func.count(model.id)).group_by(model.user_id)
+        for user_id, total, count in rows:
+            totals = user_totals.setdefault(user_id, {'total_spent': 0, 'expense_count': 0, 'total_income': 0, 'income_count': 0})
+            totals[total_columns[0]] = total
+            totals[total_columns[1]] = count
+
+        month = period_expression(model.date, 'month')
+        label = func.coalesce(Category.name, '')
+        rows = db.session.query(model.user_id, month, label, func.sum(model.amount), func.count(model.id)) \
+            .select_from(model).outerjoin(Category, model.category_id == Category.id) \
+            .group_by(model.user_id, month, label)
+        for user_id, month_key, category, total, count in rows:
+            monthly[(user_id, kind, month_key, category)] = {'total': total, 'count': count}
+
+    return user_totals, monthly
+
+@app.cli.command('rebuild-summaries')
+@click.option('--verify-only', is_flag=True, help='Report drift without rewriting the summary tables.')
+def rebuild_summaries(verify_only):
+    """Recompute the summary tables from raw rows and report any drift."""
+    user_totals, monthly = expected_summaries()
+    drift = 0
+
+    stored_totals = {summary.user_id: summary for summary in UserSummary.query}
+    for user_id in set(user_totals) | set(stored_totals):
+        expected = user_totals.get(user_id, {})
+        stored = stored_totals.get(user_id)
+        for column in ('total_spent', 'expense_count', 'total_income', 'income_count'):
+            actual = getattr(stored, column) if stored else 0
+            if actual != expected.get(column, 0):
+                drift += 1
+                print(f"user {user_id}: {column} is {actual}, expected {expected.get(column, 0)}")
+
+    stored_monthly = {(row.user_id, row.kind, row.month, row.category): row for row in MonthlySummary.query}
+    for key in set(monthly) | set(stored_monthly):
+        expected = monthly.get(key, {'total': 0, 'count': 0})
+        stored = stored_monthly.get(key)
+        actual = (stored.total, stored.count) if stored else (0, 0)
+        if actual != (expected['total'], expected['count']):
+            drift += 1
+            print(f"user {key[0]} {key[1]} {key[2]} {key[3]!r}: total/count is {actual}, expected {(expected['total'], expected['count'])}")
+
+    print(f"{drift} drifted value(s) found")
+    if verify_only:
+        if drift:
+            raise SystemExit(1)
+        return
+
+    MonthlySummary.query.delete()
+    UserSummary.query.delete()
+    db.session.bulk_insert_mappings(UserSummary, [dict(user_id=user_id, **totals) for user_id, totals in user_totals.items()])
+    db.session.bulk_insert_mappings(MonthlySummary, [
+        dict(user_id=user_id, kind=kind, month=month, category=category, **values)
+        for (user_id, kind, month, category), values in monthly.items()
+    ])
+    # Cached dashboards and ETags were built from the old totals
+    for user_id in set(user_totals) | set(stored_totals):
+        bump_data_version(user_id)
+    db.session.commit()
+    print(f"Rebuilt summaries for {len(user_totals)} user(s)")
 
 if __name__ == '__main__':
     with app.app_context():
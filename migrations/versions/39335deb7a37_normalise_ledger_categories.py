@@ -0,0 +1,66 @@
+"""normalise ledger categories
+
+Revision ID: 39335deb7a37
+Revises: 66565685f1a9
+Create Date: 2026-10-18 09:27:04.612895
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '39335deb7a37'
+down_revision = '66565685f1a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('category',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'name', name='uq_category_user_id_name')
+    )
+
+    # One row per distinct category name each user has used
+    op.execute("""
+        INSERT INTO category (user_id, name)
+        SELECT DISTINCT user_id, category FROM ledger_entry WHERE category IS NOT NULL
+    """)
+
+    op.add_column('ledger_entry', sa.Column('category_id', sa.Integer(), nullable=True))
+    op.execute("""
+        UPDATE ledger_entry SET category_id = (
+            SELECT c.id FROM category c
+            WHERE c.user_id = ledger_entry.user_id AND c.name = ledger_entry.category
+        )
+        WHERE category IS NOT NULL
+    """)
+
+    with op.batch_alter_table('ledger_entry') as batch_op:
+        batch_op.drop_index('ix_ledger_entry_user_id_kind_category_date')
+        batch_op.create_foreign_key('fk_ledger_entry_category_id_category', 'category', ['category_id'], ['id'])
+        batch_op.create_index('ix_ledger_entry_user_id_kind_category_id_date', ['user_id', 'kind', 'category_id', 'date'], unique=False)
+        batch_op.drop_column('category')
+
+
+def downgrade():
+    op.add_column('ledger_entry', sa.Column('category', sa.String(length=100), nullable=True))
+    op.execute("""
+        UPDATE ledger_entry SET category = (
+            SELECT c.name FROM category c WHERE c.id = ledger_entry.category_id
+        )
+        WHERE category_id IS NOT NULL
+    """)
+
+    with op.batch_alter_table('ledger_entry') as batch_op:
+        batch_op.drop_index('ix_ledger_entry_user_id_kind_category_id_date')
+        batch_op.drop_constraint('fk_ledger_entry_category_id_category', type_='foreignkey')
+        batch_op.create_index('ix_ledger_entry_user_id_kind_category_date', ['user_id', 'kind', 'category', 'date'], unique=False)
+        batch_op.drop_column('category_id')
+
+    op.drop_table('category')
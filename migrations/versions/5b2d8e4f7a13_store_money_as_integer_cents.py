@@ -0,0 +1,96 @@
+"""store money as integer cents
+
+Revision ID: 5b2d8e4f7a13
+Revises: cf9164c06f3b
+Create Date: 2026-10-18 14:20:41.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2d8e4f7a13'
+down_revision = 'cf9164c06f3b'
+branch_labels = None
+depends_on = None
+
+# (table, column to batch the backfill on, float columns holding money)
+MONEY_COLUMNS = [
+    ('transaction', 'id', ['amount']),
+    ('savings_goal', 'id', ['target_amount', 'current_amount']),
+    ('budget', 'id', ['limit']),
+    ('income', 'id', ['amount']),
+    ('expense', 'id', ['amount']),
+    ('balance', 'id', ['amount']),
+    ('user_summary', 'user_id', ['total_spent', 'total_income']),
+    ('monthly_summary', 'user_id', ['total']),
+]
+
+NULLABLE = {('savings_goal', 'current_amount')}
+
+BATCH_SIZE = 5000
+
+
+def copy_in_batches(table_name, key, assignments):
+    """Run UPDATE table SET ... in key ranges of BATCH_SIZE, committing after each range.
+
+    Each batch holds its row locks only until it commits, so the table stays
+    writable while a large history is converted.
+    """
+    key_column = sa.column(key)
+    table = sa.table(table_name, key_column, *(sa.column(name) for name in assignments))
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        low, high = bind.execute(sa.select(sa.func.min(key_column), sa.func.max(key_column)).select_from(table)).first()
+        if low is None:
+            return
+        for start in range(low, high + 1, BATCH_SIZE):
+            bind.execute(
+                table.update()
+                .where(key_column >= start, key_column < start + BATCH_SIZE)
+                .values(assignments)
+            )
+
+
+def upgrade():
+    # Expand: add the integer columns alongside the float ones
+    for table_name, key, columns in MONEY_COLUMNS:
+        for column in columns:
+            op.add_column(table_name, sa.Column(f'{column}_cents', sa.BigInteger(), nullable=True))
+
+    # Backfill: round each float amount to the nearest cent
+    for table_name, key, columns in MONEY_COLUMNS:
+        assignments = {
+            f'{column}_cents': sa.cast(sa.func.round(sa.column(column, sa.Float) * 100), sa.BigInteger)
+            for column in columns
+        }
+        copy_in_batches(table_name, key, assignments)
+
+    # Contract: drop the float columns and make the new ones NOT NULL where the old ones were
+    for table_name, key, columns in MONEY_COLUMNS:
+        with op.batch_alter_table(table_name) as batch_op:
+            for column in columns:
+                if (table_name, column) not in NULLABLE:
+                    batch_op.alter_column(f'{column}_cents', existing_type=sa.BigInteger(), nullable=False)
+                batch_op.drop_column(column)
+
+
+def downgrade():
+    for table_name, key, columns in MONEY_COLUMNS:
+        for column in columns:
+            op.add_column(table_name, sa.Column(column, sa.Float(), nullable=True))
+
+    for table_name, key, columns in MONEY_COLUMNS:
+        assignments = {
+            column: sa.cast(sa.column(f'{column}_cents', sa.BigInteger), sa.Float) / 100
+            for column in columns
+        }
+        copy_in_batches(table_name, key, assignments)
+
+    for table_name, key, columns in MONEY_COLUMNS:
+        with op.batch_alter_table(table_name) as batch_op:
+            for column in columns:
+                if (table_name, column) not in NULLABLE:
+                    batch_op.alter_column(column, existing_type=sa.Float(), nullable=False)
+                batch_op.drop_column(f'{column}_cents')
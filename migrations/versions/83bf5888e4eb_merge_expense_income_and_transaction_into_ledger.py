@@ -0,0 +1,133 @@
+"""merge expense, income and transaction into ledger
+
+Revision ID: 83bf5888e4eb
+Revises: 5b2d8e4f7a13
+Create Date: 2026-10-18 09:15:15.572824
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '83bf5888e4eb'
+down_revision = '5b2d8e4f7a13'
+branch_labels = None
+depends_on = None
+
+# Rows of a table numbered within each group of identical (user, amount, category, date)
+# values, so the n-th copy of an expense can be matched to the n-th copy of its transaction
+NUMBERED = """
+    SELECT user_id, amount_cents, category, date,
+           row_number() OVER (PARTITION BY user_id, amount_cents, category, date ORDER BY id) AS copy
+    FROM {table}
+"""
+
+
+def upgrade():
+    op.create_table('ledger_entry',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('amount_cents', sa.BigInteger(), nullable=False),
+    sa.Column('category', sa.String(length=100), nullable=True),
+    sa.Column('date', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    # Expenses keep their ids, so links to existing expenses stay valid
+    op.execute("""
+        INSERT INTO ledger_entry (id, user_id, kind, amount_cents, category, date)
+        SELECT id, user_id, 'expense', amount_cents, category, COALESCE(date, CURRENT_TIMESTAMP)
+        FROM expense
+    """)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("SELECT setval(pg_get_serial_sequence('ledger_entry', 'id'), COALESCE(MAX(id), 1)) FROM ledger_entry")
+
+    op.execute("""
+        INSERT INTO ledger_entry (user_id, kind, amount_cents, category, date)
+        SELECT user_id, 'income', amount_cents, source, COALESCE(date, CURRENT_TIMESTAMP)
+        FROM income
+        ORDER BY id
+    """)
+
+    # Transactions were written alongside each expense; only keep those without a matching expense
+    op.execute(f"""
+        INSERT INTO ledger_entry (user_id, kind, amount_cents, category, date)
+        SELECT t.user_id, 'expense', t.amount_cents, t.category, t.date
+        FROM ({NUMBERED.format(table='"transaction"')}) t
+        WHERE NOT EXISTS (
+            SELECT 1 FROM ({NUMBERED.format(table='expense')}) e
+            WHERE e.user_id = t.user_id AND e.amount_cents = t.amount_cents
+              AND e.category = t.category AND e.date = t.date AND e.copy = t.copy
+        )
+    """)
+
+    op.create_index('ix_ledger_entry_user_id_kind_category_date', 'ledger_entry', ['user_id', 'kind', 'category', 'date'], unique=False)
+    op.create_index('ix_ledger_entry_user_id_kind_date', 'ledger_entry', ['user_id', 'kind', 'date'], unique=False)
+    op.drop_index('ix_income_user_id_date', table_name='income')
+    op.drop_table('income')
+    op.drop_index('ix_expense_user_id_category_date', table_name='expense')
+    op.drop_index('ix_expense_user_id_date', table_name='expense')
+    op.drop_table('expense')
+    op.drop_index('ix_transaction_user_id_category_date', table_name='transaction')
+    op.drop_index('ix_transaction_user_id_date', table_name='transaction')
+    op.drop_table('transaction')
+
+
+def downgrade():
+    op.create_table('transaction',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('category', sa.String(length=50), nullable=False),
+    sa.Column('date', sa.DateTime(), nullable=False),
+    sa.Column('amount_cents', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_transaction_user_id_date', 'transaction', ['user_id', 'date'], unique=False)
+    op.create_index('ix_transaction_user_id_category_date', 'transaction', ['user_id', 'category', 'date'], unique=False)
+    op.create_table('expense',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('category', sa.String(length=100), nullable=True),
+    sa.Column('date', sa.DateTime(), nullable=True),
+    sa.Column('amount_cents', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_expense_user_id_date', 'expense', ['user_id', 'date'], unique=False)
+    op.create_index('ix_expense_user_id_category_date', 'expense', ['user_id', 'category', 'date'], unique=False)
+    op.create_table('income',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('source', sa.String(length=100), nullable=True),
+    sa.Column('date', sa.DateTime(), nullable=True),
+    sa.Column('amount_cents', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_income_user_id_date', 'income', ['user_id', 'date'], unique=False)
+
+    # Restore the old layout, writing every expense to both tables again
+    op.execute("""
+        INSERT INTO expense (id, user_id, amount_cents, category, date)
+        SELECT id, user_id, amount_cents, category, date FROM ledger_entry WHERE kind = 'expense'
+    """)
+    op.execute("""
+        INSERT INTO "transaction" (id, user_id, amount_cents, category, date)
+        SELECT id, user_id, amount_cents, SUBSTR(COALESCE(category, 'Uncategorized'), 1, 50), date
+        FROM ledger_entry WHERE kind = 'expense'
+    """)
+    op.execute("""
+        INSERT INTO income (id, user_id, amount_cents, source, date)
+        SELECT id, user_id, amount_cents, category, date FROM ledger_entry WHERE kind = 'income'
+    """)
+    if op.get_bind().dialect.name == 'postgresql':
+        for table in ('expense', 'transaction', 'income'):
+            op.execute(f'SELECT setval(pg_get_serial_sequence(\'"{table}"\', \'id\'), COALESCE(MAX(id), 1)) FROM "{table}"')
+
+    op.drop_index('ix_ledger_entry_user_id_kind_date', table_name='ledger_entry')
+    op.drop_index('ix_ledger_entry_user_id_kind_category_date', table_name='ledger_entry')
+    op.drop_table('ledger_entry')
@@ -0,0 +1,51 @@
+"""add ledger search indexes
+
+Revision ID: a1abe3ae13a6
+Revises: 39335deb7a37
+Create Date: 2026-10-18 09:32:52.563332
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1abe3ae13a6'
+down_revision = '39335deb7a37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_ledger_entry_user_id_date', 'ledger_entry', ['user_id', 'date'], unique=False)
+
+    # Full-text search over category names is SQLite-only; other databases search the category table directly
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("CREATE VIRTUAL TABLE category_search USING fts5(name, owner, tokenize='porter unicode61 remove_diacritics 2')")
+    op.execute("""
+        CREATE TRIGGER category_search_insert AFTER INSERT ON category BEGIN
+            INSERT INTO category_search (rowid, name, owner) VALUES (new.id, new.name, 'u' || new.user_id);
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER category_search_update AFTER UPDATE ON category BEGIN
+            UPDATE category_search SET name = new.name, owner = 'u' || new.user_id WHERE rowid = old.id;
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER category_search_delete AFTER DELETE ON category BEGIN
+            DELETE FROM category_search WHERE rowid = old.id;
+        END
+    """)
+    op.execute("INSERT INTO category_search (rowid, name, owner) SELECT id, name, 'u' || user_id FROM category")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('DROP TRIGGER IF EXISTS category_search_delete')
+        op.execute('DROP TRIGGER IF EXISTS category_search_update')
+        op.execute('DROP TRIGGER IF EXISTS category_search_insert')
+        op.execute('DROP TABLE IF EXISTS category_search')
+
+    op.drop_index('ix_ledger_entry_user_id_date', table_name='ledger_entry')
@@ -0,0 +1,44 @@
+// Infinite scroll for keyset-paginated listings.
+// Appends the next page from `url` (requested with format=json) to `list`
+// whenever `sentinel` scrolls into view, until the server stops returning a cursor.
+function infiniteScroll(list, sentinel, url, renderItem) {
+    let cursor = sentinel.dataset.nextCursor;
+    let loading = false;
+
+    if (!cursor) {
+        sentinel.style.display = 'none';
+        return;
+    }
+
+    const observer = new IntersectionObserver(entries => {
+        if (!entries[0].isIntersecting || loading || !cursor) {
+            return;
+        }
+        loading = true;
+
+        fetch(`${url}?format=json&cursor=${encodeURIComponent(cursor)}`)
+            .then(response => response.json())
+            .then(page => {
+                page.items.forEach(item => list.appendChild(renderItem(item)));
+                cursor = page.next_cursor;
+                if (!cursor) {
+                    observer.disconnect();
+                    sentinel.style.display = 'none';
+                }
+            })
+            .catch(error => console.error('Error loading more records:', error))
+            .finally(() => {
+                loading = false;
+            });
+    });
+
+    observer.observe(sentinel);
+}
+
+// Render a record as a Bootstrap list item: "YYYY-MM-DD - label: $amount"
+function listItem(date, label, amount) {
+    const li = document.createElement('li');
+    li.className = 'list-group-item';
+    li.textContent = `${date.slice(0, 10)} - ${label}: $${Number(amount).toFixed(2)}`;
+    return li;
+}